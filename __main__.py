@@ -23,96 +23,256 @@ Open Parliament Licence:
 
 import re
 import os
-import glob
-import pandas as pd
-import pandas.formats
-import pandas.io.formats.excel
 
-from src.capture_text import Downloader
-from src.utils import logger, args
-
-from src.parse_text import transcript
-from src.analyse_transcript import analyse_json
+from src.utils import logger, args, configure
+from src.document_store import document_store
 
+# Heavy libraries (Selenium, spaCy, pandas, matplotlib) are only imported
+# by the modes which use them, so that each mode starts quickly.
 
 
 def main():
+    configure()
 
     if args.download:
         # Download all files
-        downloader = Downloader()
+        from src.capture_text import Downloader, crawl_committees_in_parallel
+        from src.static_crawler import StaticDownloader
+        downloader_class = StaticDownloader if args.crawler == 'static' \
+            else Downloader
+        downloader = downloader_class(
+            browser_id=0 if args.browsers > 1 else None)
         all_committees = downloader.committees_urls_list()
         logger.info("Starting to process %i committees" % len(all_committees))
 
-        for idx, committee_url in enumerate([c for c in all_committees]): #  if 'foreign-affairs-committee' in c]):
-            downloader.capture_committee_documents(committee_url)
-            logger.info('Completed committee %i / %i' % (idx, len(all_committees)))
-        pass
-
+        if args.browsers > 1:
+            crawl_committees_in_parallel(downloader, all_committees,
+                                         args.browsers)
+        else:
+            for idx, committee_url in enumerate([c for c in all_committees]): #  if 'foreign-affairs-committee' in c]):
+                downloader.capture_committee_documents(committee_url)
+                logger.info('Completed committee %i / %i' % (idx, len(all_committees)))
+        downloader.close()
+        if all(downloader.manifest.is_committee_complete(c)
+               for c in all_committees):
+            # the crawl is complete: the next run starts a fresh crawl,
+            # which only downloads new or changed documents
+            downloader.manifest.reset_committees()
+
+
+    if args.compare_html:
+        # check the lxml html engine against html2text on a sample of
+        # stored documents
+        import random
+        from src.html_convert import compare_with_html2text
+        html_filenames = document_store().names('*.html')
+        sample = random.Random(0).sample(
+            html_filenames, min(args.compare_html, len(html_filenames)))
+        compare_with_html2text(sample, document_store())
 
     if args.parse:
-        # Parse all HTML files, store to JSON, and summarise in XLSX
-        html_filenames = glob.glob(os.path.expanduser(
-            '~/projects_data/parliament-text/*.html'))
-        df = pd.DataFrame(columns=['members','witnesses',
-                                            'speakers_dict','Q&A','plain_text'],
-                                   index=[])
-        for i, html_filename in enumerate(html_filenames[100:200]):
-            with open(html_filename, 'r') as f:
-                html_text = f.read()
-            logger.info('%i / %i: %s' % (i, len(html_filenames), html_filename))
-            trscrpt = transcript(html_text,
-                                 {'status': 'read html from directory',
-                                  'html_file_location': f.name},
-                                 html_filename=html_filename)
-            trscrpt.process_raw_html()
-            key_data, hyperlink = trscrpt.key_data_summary()
-            df.loc[hyperlink] = key_data
-
-        xlsx_filename = 'summary.xlsx'
-        key_data_to_xlsx(df, xlsx_filename)
+        # Parse all HTML files, saving the outputs asked for: text and JSON
+        # per document, an XLSX summary, and speaker statistics
+        import pandas as pd
+        from src.parse_pool import parse_corpus, get_quarantine, \
+            skip_quarantined
+        from src.parse_watchdog import REGEX_TIMEOUT
+        if args.html_engine == 'lxml':
+            logger.warning('--html_engine lxml is experimental: check it '
+                           'against html2text with --compare_html first')
+        if args.parse_timeout and not REGEX_TIMEOUT:
+            logger.warning('No regex module with match timeouts (needs regex '
+                           '2019.12.20 or later): the parser\'s regular '
+                           'expressions will run without a time limit')
+        quarantined = get_quarantine().names()
+        # leave out documents which ran over their time budget before
+        html_filenames = skip_quarantined(document_store().names('*.html'))
+
+        # only parse the documents which are new or changed, or were parsed
+        # by a different parser, or have lost their outputs; the others are
+        # skipped, or read back from their saved JSON when the summary,
+        # stats or tables need them
+        from src.parse_manifest import ParseManifest, parser_version, \
+            document_sha1, output_name
+        from src.corpus_tables import CorpusWriter, corpus_tables_path
+        store = document_store()
+        parse_manifest = ParseManifest(args.storage)
+        version = parser_version()
+        document_outputs = [o for o in ['txt', 'json'] if o in args.outputs]
+        tables_output = {'format': args.tables_format,
+                         'path': corpus_tables_path(args.storage,
+                                                    args.tables_format)}
+        html_sha1s = {f: document_sha1(store, f) for f in html_filenames}
+        saved_outputs = {}
+        skipped = 0
+        # (with an in-memory person registry, canonical ids aren't the same
+        # from one run to the next, so everything is parsed again)
+        if not args.force and args.person_registry == 'disk':
+            corpus_outputs = [o for o in ['summary', 'stats', 'tables']
+                              if o in args.outputs]
+            # the SQLite tables keep each document's rows from one run to
+            # the next, so those documents don't need their JSON read back
+            sqlite_tables_only = corpus_outputs == ['tables'] and \
+                args.tables_format == 'sqlite'
+            to_parse = []
+            for f in html_filenames:
+                if not parse_manifest.is_current(
+                        f, html_sha1s[f], version,
+                        document_outputs + (['json'] if corpus_outputs and
+                                            not sqlite_tables_only else []),
+                        store):
+                    to_parse.append(f)
+                    continue
+                outputs = parse_manifest.saved_outputs(f)
+                if sqlite_tables_only and \
+                        outputs.get('tables') == tables_output and \
+                        os.path.exists(tables_output['path']):
+                    # its rows are already in the database
+                    skipped += 1
+                elif corpus_outputs and parse_manifest.is_current(
+                        f, html_sha1s[f], version, ['json'], store):
+                    saved_outputs[f] = outputs
+                    to_parse.append(f)
+                elif corpus_outputs:
+                    to_parse.append(f)
+                else:
+                    skipped += 1
+            html_filenames = to_parse
+        logger.info('Parsing %i documents (%i read back from an earlier '
+                    'parse, %i skipped as unchanged)' % (
+                        len(html_filenames) - len(saved_outputs),
+                        len(saved_outputs), skipped))
+        corpus_writer = None
+        if 'tables' in args.outputs:
+            corpus_writer = CorpusWriter(tables_output['path'],
+                                         args.tables_format)
+        results = []
+        from src.download_manifest import DownloadManifest
+        document_urls = DownloadManifest(args.storage).document_urls()
+        for html_filename, result in zip(
+                html_filenames,
+                parse_corpus(html_filenames, args.parse_processes,
+                             document_urls=document_urls,
+                             saved_outputs=saved_outputs)):
+            if result is None:
+                continue
+            hyperlink, key_data, stats_records, table_rows = result
+            if corpus_writer:
+                corpus_writer.add(table_rows)
+            results.append((hyperlink, key_data, stats_records))
+            if html_filename in saved_outputs:
+                outputs = saved_outputs[html_filename]
+            else:
+                outputs = {o: {'name': output_name(html_filename, o),
+                               'sha1': store.sha1(output_name(html_filename,
+                                                              o))}
+                           for o in document_outputs}
+            if corpus_writer:
+                outputs['tables'] = tables_output
+            parse_manifest.record_parse(html_filename,
+                                        html_sha1s[html_filename],
+                                        version, outputs)
+        if corpus_writer:
+            corpus_writer.close()
+        parse_manifest.save()
+        newly_quarantined = get_quarantine().names() - quarantined
+        if newly_quarantined:
+            logger.warning('%i documents ran over --parse_timeout and were '
+                           'quarantined: %s' % (
+                               len(newly_quarantined),
+                               ', '.join(sorted(newly_quarantined))))
+
+        if 'summary' in args.outputs:
+            df = pd.DataFrame([key_data for hyperlink, key_data, _
+                               in results],
+                              columns=['members', 'witnesses',
+                                       'speakers_dict', 'Q&A', 'plain_text'],
+                              index=[hyperlink for hyperlink, key_data, _
+                                     in results])
+            xlsx_filename = 'summary.xlsx'
+            key_data_to_xlsx(df, xlsx_filename)
+
+        if 'stats' in args.outputs:
+            # straight from the HTML to the speaker statistics, without
+            # reading back the JSON files as --diagnostic does
+            from src.analyse_transcript import stats_table
+            df_all_speaker_stats = stats_table(
+                [record for _, _, stats_records in results
+                 for record in stats_records])
+            speaker_data_to_xlsx(df_all_speaker_stats, 'speaker_summary.xlsx')
 
     if False:
         # Parse selected files
+        from src.parse_text import transcript
         key_html_documents = [
             '45429.html',
             '74822.html'
             # 'http://data.parliament.uk/writtenevidence/committeeevidence.svc/evidencedocument/treasury-committee/monetary-policy-forward-guidance/oral/3245.html'
         ]
         for d in key_html_documents:
-            with open(os.path.join(os.path.expanduser('~/projects_data/parliament-text'), d),
-                      'r') as f:
-                html_text = f.read()
+            html_text = document_store().get_text(d)
 
             trscrpt = transcript(html_text, {'status': 'debugging case'}, html_filename=d)
             trscrpt.process_raw_html()
 
-    if args.diagnostic:
+    if args.diagnostic and args.from_tables:
+        # the same, from the corpus tables in a single read
+        from src.analyse_transcript import analyse_tables
+        df_all_speaker_stats = analyse_tables(witness_tables())
+        speaker_data_to_xlsx(df_all_speaker_stats, 'speaker_summary.xlsx')
+
+    elif args.diagnostic:
         # generate diagnostic spreadsheet summarising success of parsing
-        all_summaries = []
-        json_filenames = glob.glob(os.path.expanduser(
-            '~/projects_data/parliament-text/*.json'))
+        import json
+        from src.analyse_transcript import witness_records, stats_table
+        # every witness's counts, made into a table once at the end
+        all_records = []
+        store = document_store()
+        json_filenames = store.names('*.json')
         # df_analysis = pd.DataFrame(columns=['members','witnesses',
         #                                     'speakers_dict','Q&A','plain_text'],
         #                            index=[])
+        # only analyse the JSON documents which have changed since the last
+        # run, or all of them after a change to the analysis
+        from src.parse_manifest import ParseManifest, analysis_version
+        parse_manifest = ParseManifest(args.storage)
+        version = analysis_version()
+        reused = 0
         for i, json_filename in enumerate(json_filenames):
-            with open(json_filename, 'r') as f:
-                json_text = f.read()
+            json_sha1 = store.sha1(json_filename)
+            records = None if args.force or json_sha1 is None else \
+                parse_manifest.analysis(json_filename, json_sha1, version)
+            if records is not None:
+                all_records.extend(records)
+                reused += 1
+                continue
+            json_text = store.get_text(json_filename)
             logger.info('%i / %i: %s' % (i, len(json_filenames), json_filename))
-            transcript_summary = analyse_json(json_text)
-            all_summaries.append(transcript_summary)
+            records = witness_records(json.loads(json_text))
+            all_records.extend(records)
+            if json_sha1 is not None:
+                parse_manifest.record_analysis(json_filename, json_sha1,
+                                               version, records)
             # key_data, hyperlink = trscrpt.key_data_summary()
             # df.loc[hyperlink] = key_data
-        df_all_speaker_stats = pd.concat(all_summaries, ignore_index=True)
+        parse_manifest.save()
+        logger.info('Analysed %i JSON documents, %i unchanged since the '
+                    'last run' % (len(json_filenames) - reused, reused))
+        df_all_speaker_stats = stats_table(all_records)
         speaker_data_to_xlsx(df_all_speaker_stats, 'speaker_summary.xlsx')
 
     elif args.analyse:
         # a quick chart to show how we might use the data
-        df_all_speaker_stats = pd.read_excel('speaker_summary.xlsx',
-                                             sheet_name='speaker_stats',
-                                             # skiprows=3,
-                                             header=0
-                                             )
+        import pandas as pd
+        if args.from_tables:
+            from src.analyse_transcript import analyse_tables
+            df_all_speaker_stats = analyse_tables(witness_tables())
+        else:
+            df_all_speaker_stats = pd.read_excel('speaker_summary.xlsx',
+                                                 sheet_name='speaker_stats',
+                                                 # skiprows=3,
+                                                 header=0
+                                                 )
         df_all_speaker_stats['title'] = df_all_speaker_stats['witness_name'].str.extract('(MP|Professor|Rt Hon|Lord QC|Dr |Brigadier|Commodore|Colonel|General|Marshal|Sir|Reverend|Rev\.|Rt Rev)', expand=False).str.strip()
         df_all_speaker_stats.loc[df_all_speaker_stats.title.isna(),'title'] ='other'
         df_all_speaker_stats.title = df_all_speaker_stats.title.str.replace(re.compile('(Rev\.|Rt Rev)'), 'Reverend')
@@ -140,8 +300,23 @@ def main():
 
 
 
+def witness_tables():
+    # the people and sections tables, as read by analyse_tables: from the
+    # transcript database, just the witnesses' rows, using its indexes
+    from src.corpus_tables import load_corpus_tables, corpus_tables_path
+    tables_path = corpus_tables_path(args.storage, args.tables_format)
+    if args.tables_format == 'sqlite':
+        from src.transcript_db import TranscriptDB
+        return TranscriptDB(tables_path).read_tables(
+            ['people', 'sections'], speaker_type='witness')
+    return load_corpus_tables(tables_path, args.tables_format,
+                              tables=['people', 'sections'])
+
+
 def key_data_to_xlsx(df, xlsx_filename):
     # Save dataframe to xlsx, with formatting for readability
+    import pandas as pd
+    import pandas.io.formats.excel
 
     n_rows = df.shape[0]
     writer = pd.ExcelWriter(xlsx_filename, engine='xlsxwriter')
@@ -165,6 +340,8 @@ def key_data_to_xlsx(df, xlsx_filename):
 
 def speaker_data_to_xlsx(df, xlsx_filename):
     # save speaker stats to xlsx
+    import pandas as pd
+    import pandas.io.formats.excel
     writer = pd.ExcelWriter(xlsx_filename, engine='xlsxwriter')
     pandas.io.formats.excel.header_style = None
     df.to_excel(writer, sheet_name='speaker_stats')
@@ -1,49 +1,139 @@
-
 import json
 import pandas as pd
-from textstat.textstat import textstat
+from .readability import Readability, text_standard, \
+    syllables_per_word_column, gunning_fog_column, smog_index_column
+
+STATS_COLUMNS = ['html_file_location', 'witness_name', 'canonical_id',
+                 'syllable_count', 'lexicon_count', 'sentence_count',
+                 'syllables_per_word', 'gunning_fog', 'smog_index',
+                 'text_standard']
+# what witness_counts records for each witness, from which stats_table
+# works out the rest of STATS_COLUMNS
+COUNT_COLUMNS = ['html_file_location', 'witness_name', 'canonical_id',
+                 'syllable_count', 'lexicon_count', 'sentence_count',
+                 'difficult_words', 'polysyllable_count', 'text_standard']
+
+_readability = None
+
+
+def get_readability():
+    """The readability engine, whose syllable counts are kept for the
+    whole corpus"""
+    global _readability
+    if _readability is None:
+        _readability = Readability()
+    return _readability
+
 
 def analyse_json(json_text):
     # consider moving this to be a feature of Transcript in the other module
+    return analyse_transcript(json.loads(json_text))
 
-    df_witnesses = pd.DataFrame(columns=['html_file_location', 'witness_name',
-                                         'syllable_count','lexicon_count',
-                                         'sentence_count',
-                                         'syllables_per_word',
-                                         'gunning_fog', 'smog_index',
-                                         'text_standard'],
-                      index=[])
 
-    trscrpt = json.loads(json_text)
+def analyse_transcript(trscrpt):
+    """Readability statistics for each witness in a parsed transcript
+
+    :param trscrpt: transcript_data dict, as parsed by
+        transcript.parse_plain_text or read from its JSON file (not
+        modified)
+    :return: DataFrame with a row for each witness
+    """
+    return stats_table(witness_records(trscrpt))
+
+
+def witness_records(trscrpt):
+    """Readability counts for each witness in a parsed transcript
+
+    For many transcripts, gather all their records and make them into a
+    table once, with stats_table.
+    :param trscrpt: transcript_data dict (not modified)
+    :return: list of witness_counts dicts
+    """
+    records = []
     if 'witnesses' in trscrpt:
         witnesses = trscrpt['witnesses']
 
-
+        # everything each witness said, kept apart from the transcript data
+        all_text = {}
         for s in trscrpt['all_sections']:
             if 'speaker' in s and 'person' in s['speaker'] and \
                     s['speaker']['person']['speaker_type']=='witness':
-                witness =  witnesses[s['speaker']['person']['name']]
-                witness.setdefault('all_text', []).append(s['spoken_text'])
-
-        for i, p in enumerate(witnesses):
-            if 'all_text' in witnesses[p]:
-                witness_text = '\n\n'.join(witnesses[p]['all_text'])
-                if len(witness_text) > 0:
-                    stats_data = {'html_file_location': trscrpt['html_file_location'],
-                                  'witness_name': p,
-                                  'syllable_count': textstat.syllable_count(witness_text),
-                                  'lexicon_count': textstat.lexicon_count(witness_text),
-                                  'sentence_count': textstat.sentence_count(witness_text),
-                                  'syllables_per_word': textstat.avg_syllables_per_word(witness_text),
-                                  'gunning_fog': textstat.gunning_fog(witness_text),
-                                  'smog_index': textstat.smog_index(witness_text),
-                                  'text_standard': textstat.text_standard(witness_text)}
-                    df_witnesses.loc['witness_%i' % i] = stats_data
-                else:
-                    df_witnesses.loc['witness_%i' % i, 'html_file_location'] = trscrpt['html_file_location']
-                    df_witnesses.loc['witness_%i' % i, 'witness_name'] = p
-            else:
-                df_witnesses.loc['witness_%i' % i, 'html_file_location'] = trscrpt['html_file_location']
-                df_witnesses.loc['witness_%i' % i, 'witness_name'] = p
-
-    return df_witnesses
\ No newline at end of file
+                all_text.setdefault(s['speaker']['person']['name'], []).append(s['spoken_text'])
+
+        for p in witnesses:
+            records.append(witness_counts(
+                trscrpt['html_file_location'], p,
+                witnesses[p].get('canonical_id'), all_text.get(p, [])))
+
+    return records
+
+
+def analyse_tables(tables):
+    """Readability statistics for every witness in the corpus, from the
+    corpus tables
+
+    Gives the same rows as analyse_transcript for each transcript in turn,
+    without reading the transcripts' JSON files.
+    :param tables: dict of DataFrames, from corpus_tables.load_corpus_tables
+    :return: DataFrame with a row for each witness
+    """
+    sections = tables['sections']
+    witness_sections = sections[sections['speaker_type'] == 'witness']
+    all_text = {key: list(spoken_text) for key, spoken_text in
+                witness_sections.groupby(['document', 'speaker_name'],
+                                         sort=False)['spoken_text']}
+    people = tables['people']
+    witnesses = people[people['speaker_type'] == 'witness']
+    return stats_table(
+        [witness_counts(document, name, canonical_id,
+                        all_text.get((document, name), []))
+         for document, name, canonical_id in
+         zip(witnesses['document'], witnesses['person_key'],
+             witnesses['canonical_id'])])
+
+
+def witness_counts(html_file_location, witness_name, canonical_id,
+                   spoken_texts):
+    """Readability counts for everything a witness said
+
+    :param spoken_texts: list of the witness's answers
+    :return: dict of COUNT_COLUMNS, with only the witness's details if they
+        said nothing
+    """
+    record = {'html_file_location': html_file_location,
+              'witness_name': witness_name,
+              'canonical_id': canonical_id}
+    witness_text = '\n\n'.join(spoken_texts)
+    if len(witness_text) > 0:
+        counts = get_readability().counts(witness_text)
+        for column in ['syllable_count', 'lexicon_count', 'sentence_count',
+                       'difficult_words', 'polysyllable_count']:
+            record[column] = counts[column]
+        # (the consensus of textstat's measures, which can't be worked out
+        # for a whole column at once)
+        record['text_standard'] = text_standard(counts)
+    return record
+
+
+def stats_table(records):
+    """The readability statistics table, from witness_counts records
+
+    The table is made in one go, and the syllables per word, Gunning fog
+    and SMOG index are worked out for all the rows at once.
+    :param records: list of witness_counts dicts, e.g. for a whole corpus
+    :return: DataFrame of STATS_COLUMNS, with a row for each record
+    """
+    df = pd.DataFrame(records, columns=COUNT_COLUMNS)
+    syllable_counts, lexicon_counts, sentence_counts, difficult_words, \
+        polysyllable_counts = [
+            df[column].values.astype(float)
+            for column in ['syllable_count', 'lexicon_count',
+                           'sentence_count', 'difficult_words',
+                           'polysyllable_count']]
+    df['syllables_per_word'] = syllables_per_word_column(syllable_counts,
+                                                         lexicon_counts)
+    df['gunning_fog'] = gunning_fog_column(lexicon_counts, sentence_counts,
+                                           difficult_words)
+    df['smog_index'] = smog_index_column(sentence_counts,
+                                         polysyllable_counts)
+    return df[STATS_COLUMNS]
@@ -0,0 +1,120 @@
+from .utils import args, logger
+from .fetch_documents import DocumentFetcher
+from .retry import AsyncAdaptiveLimit, RetriesExhausted
+
+from urllib.parse import urlparse
+import threading
+import asyncio
+import aiohttp
+
+
+class AsyncDocumentFetcher(DocumentFetcher):
+    """Download documents on a single asyncio event loop
+
+    An alternative to the thread pool of DocumentFetcher for bulk backfills:
+    thousands of downloads can be in flight at once on one event loop
+    (running in a background thread), with file writes handed to an
+    executor so they don't block the loop. submit() and
+    download_and_process_document() behave as in DocumentFetcher, so the
+    crawlers use either fetcher in the same way. The requests session of
+    DocumentFetcher is still used by the static crawler for listing pages.
+    """
+    def __init__(self, pipeline, storage_path=None, max_in_flight=None,
+                 **kwargs):
+        super().__init__(pipeline, storage_path, **kwargs)
+        self.max_in_flight = max_in_flight or args.async_in_flight
+        self.loop = asyncio.new_event_loop()
+        self.loop_thread = threading.Thread(target=self._run_loop,
+                                            name='async-fetcher', daemon=True)
+        self.loop_thread.start()
+        asyncio.run_coroutine_threadsafe(self._start(), self.loop).result()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    async def _start(self):
+        self.in_flight = AsyncAdaptiveLimit(self.max_in_flight)
+        self.next_host_slot = {}
+        connector = aiohttp.TCPConnector(
+            limit=self.max_in_flight, limit_per_host=self.host_concurrency)
+        self.http = aiohttp.ClientSession(
+            connector=connector, timeout=aiohttp.ClientTimeout(total=20))
+
+    async def _wait_for_host_slot(self, url):
+        # reserve the next free time slot for this host, then wait for it
+        host = urlparse(url).netloc
+        now = self.loop.time()
+        slot = max(now, self.next_host_slot.get(host, 0))
+        if self.host_rate:
+            self.next_host_slot[host] = slot + 1.0 / self.host_rate
+        await asyncio.sleep(slot - now)
+
+    def submit(self, url, filename, source_document_locations):
+        future = asyncio.run_coroutine_threadsafe(
+            self.download_and_process_document_async(
+                url, filename, source_document_locations),
+            self.loop)
+        with self.lock:
+            self.pending.add(future)
+        future.add_done_callback(self._download_done)
+        return future
+
+    def download_and_process_document(self, url, filename,
+                                      source_document_locations):
+        """Download and store a HTML or PDF document, blocking until done
+
+        :return: True if the document was stored
+        """
+        return self.submit(url, filename, source_document_locations).result()
+
+    async def download_and_process_document_async(self, url, filename,
+                                                  source_document_locations):
+        """Coroutine which downloads and stores a HTML or PDF document
+
+        :return: True if the document was stored
+        """
+        # (which may read the stored document, to enter it in the manifest)
+        already_stored = await self.loop.run_in_executor(
+            self.executor, self.already_stored, url, filename)
+        if already_stored and not args.refresh:
+            logger.debug("Already downloaded: " + url)
+            return True
+
+        headers = self.manifest.conditional_headers(url) \
+            if already_stored else {}
+
+        async def get_document():
+            async with self.http.get(url, headers=headers) as r:
+                if r.status >= 500:
+                    # server errors count towards the circuit breaker
+                    r.raise_for_status()
+                return r.status, await r.read(), r.headers
+
+        logger.info("Document: " + url)
+        try:
+            # in-flight requests are limited as in DocumentFetcher, halving
+            # when a host's circuit opens; waiting for the host's rate limit
+            # doesn't count as in flight
+            status, content, response_headers = \
+                await self.scheduler.call_async(
+                    url, get_document,
+                    retry_on=(aiohttp.ClientError, asyncio.TimeoutError),
+                    limit=self.in_flight,
+                    wait_for_turn=lambda: self._wait_for_host_slot(url))
+        except RetriesExhausted:
+            return False
+        # writing the file and queueing the parse may block, so do that
+        # on an executor thread rather than in the event loop
+        return await self.loop.run_in_executor(
+            self.executor, self.store_document, url, filename, status,
+            content, response_headers, already_stored,
+            source_document_locations)
+
+    def shutdown(self):
+        self.wait()
+        asyncio.run_coroutine_threadsafe(self.http.close(),
+                                         self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.loop_thread.join()
+        super().shutdown()
@@ -1,16 +1,23 @@
-from .utils import args, logger
-from .parse_text import transcript
+from .utils import args, logger, ContextLogger
+from .fetch_documents import DocumentFetcher
+from .download_manifest import DownloadManifest
+from .parse_pipeline import ParsePipeline
+from .crawl_frontier import CrawlFrontier
+from .retry import RetriesExhausted
 
 from selenium import webdriver
+from selenium.common.exceptions import NoSuchElementException
 from selenium.common.exceptions import StaleElementReferenceException
 from selenium.common.exceptions import TimeoutException
+from selenium.common.exceptions import UnexpectedTagNameException
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.firefox.options import Options
 from selenium.webdriver.support.ui import Select
 
-import sys
+import threading
+import queue
 from time import sleep
-import os
 import re
-import requests
 
 
 # TODO: what about evidence that doesn't form part of an inquiry: http://www.parliament.uk/business/committees/committees-a-z/lords-select/ai-committee/publications/
@@ -18,12 +25,81 @@ import requests
 # TODO: need to drill down through HTML pages too and find unstructured oral evidence e.g. http://www.parliament.uk/business/committees/committees-a-z/commons-select/administration-committee/inquiries/parliament-2010/induction-arrangements-for-new-members-of-parliament/
 
 
+class ListingIncomplete(Exception):
+    """A listing page loaded, but not all of its listings could be read"""
+    pass
+
+
 class Downloader(object):
     """Download full or partial Parliamentary committee transcript records"""
-    def __init__(self):
+    def __init__(self, browser_id=None, headless=None, shared_with=None):
+        """
+        :param browser_id: label for this browser in log messages, when
+            several browsers crawl in parallel
+        :param headless: run the browser without a display
+        :param shared_with: another Downloader whose manifest, document
+            fetcher and parse pipeline this one should share
+        """
         self.committees_page = 'http://www.parliament.uk/business/committees/committees-a-z/'
-        self.browser = webdriver.Firefox()
         self.storage_path = args.storage
+        self.headless = args.headless if headless is None else headless
+        if browser_id is None:
+            self.logger = logger
+        else:
+            self.logger = ContextLogger(logger,
+                                        {'context': 'browser %s' % browser_id})
+        self._browser = None  # started on first use
+        if shared_with:
+            self.manifest = shared_with.manifest
+            self.pipeline = shared_with.pipeline
+            self.fetcher = shared_with.fetcher
+            self.frontier = shared_with.frontier
+            self.owns_workers = False
+        else:
+            self.manifest = DownloadManifest(self.storage_path)
+            self.pipeline = ParsePipeline()
+            fetcher_class = DocumentFetcher
+            if args.download_mode == 'async':
+                from .async_fetch import AsyncDocumentFetcher as fetcher_class
+            self.fetcher = fetcher_class(self.pipeline, self.storage_path,
+                                         manifest=self.manifest)
+            self.frontier = CrawlFrontier(self.storage_path,
+                                          ttl_hours=args.listing_ttl)
+            self.owns_workers = True
+        self.committee_downloads = []
+        # documents found beneath each listing page currently being visited
+        self.visits_in_progress = []
+
+    @property
+    def browser(self):
+        if self._browser is None:
+            self._browser = self.new_browser()
+        return self._browser
+
+    def new_browser(self):
+        options = Options()
+        if self.headless:
+            options.add_argument('-headless')
+        return webdriver.Firefox(firefox_options=options)
+
+    def restart_browser(self):
+        """Replace a crashed browser with a fresh one"""
+        if self._browser is not None:
+            try:
+                self._browser.quit()
+            except WebDriverException:
+                pass
+        self._browser = None
+
+    def close(self):
+        """Wait for queued downloads and parsing to complete, then close
+        the browser"""
+        if self.owns_workers:
+            self.fetcher.shutdown()
+            self.pipeline.close()
+            self.frontier.save()
+        if self._browser is not None:
+            self._browser.quit()
 
 
     def committees_urls_list(self):
@@ -44,9 +120,41 @@ class Downloader(object):
 
         :param committee_url: URL of the committee homepage
         """
-        self.browser.set_page_load_timeout(10)
-        logger.warning('Starting new committee: ' + committee_url)
+        if self.manifest.is_committee_complete(committee_url) \
+                and not args.recrawl:
+            self.logger.info('Committee already crawled: ' + committee_url)
+            return
+        self.logger.warning('Starting new committee: ' + committee_url)
+        self.committee_downloads = []
+        self.committee_incomplete = False
 
+        try:
+            self.crawl_committee_pages(committee_url)
+        except RetriesExhausted:
+            # leave the committee un-checkpointed, so it's tried next time
+            self.logger.error('Skipping committee: ' + committee_url)
+            return
+
+        if self.committee_incomplete:
+            # some listings failed, so the committee is crawled again
+            # next time
+            self.logger.warning('Not checkpointing committee, some listings '
+                                'failed: ' + committee_url)
+            return
+
+        # checkpoint the committee once all of its documents are stored
+        def checkpoint(all_succeeded):
+            if all_succeeded:
+                self.manifest.mark_committee_complete(committee_url)
+        self.fetcher.on_complete(self.committee_downloads, checkpoint)
+
+    def crawl_committee_pages(self, committee_url):
+        """Find the committee's Publications and Inquiries sections, and
+        crawl each of them
+
+        :param committee_url: URL of the committee homepage
+        """
+        self.browser.set_page_load_timeout(10)
 
         """Sometimes there's no Inquiries selection, and we go 
         straight to Publications, e.g.: 
@@ -57,9 +165,9 @@ class Downloader(object):
         if len(pubs_links) > 0 and committee_url in pubs_links[0].get_attribute(
                 'href'):
             publications_url = pubs_links[0].get_attribute('href')
-            self.crawl_publications_section(publications_url)
+            self.visit(publications_url, self.crawl_publications_section)
         else:
-            logger.warning(
+            self.logger.warning(
                 "No Top-Level Publications Link for this committee: "
                 + committee_url)
 
@@ -69,12 +177,44 @@ class Downloader(object):
         if len(inquiries_links) > 0 and committee_url in inquiries_links[
             0].get_attribute('href'):
             inquiries_url = inquiries_links[0].get_attribute('href')
-            logger.info("Processing all inquiries: " + inquiries_url)
-            self.crawl_inquiries_section(inquiries_url)
+            self.logger.info("Processing all inquiries: " + inquiries_url)
+            self.visit(inquiries_url, self.crawl_inquiries_section)
         else:
-            logger.warning("No Inquiries for this committee: " + committee_url)
+            self.logger.warning("No Inquiries for this committee: " + committee_url)
 
 
+    def visit(self, page_url, crawl_function):
+        """Crawl a listing page, unless it was crawled recently
+
+        Pages crawled within the frontier's TTL are not loaded again:
+        instead we re-queue the documents found beneath them last time.
+        :param page_url: URL of the listing page
+        :param crawl_function: method which crawls the page, given its URL
+        """
+        cached_documents = self.frontier.cached_documents(page_url)
+        if cached_documents is not None:
+            self.logger.info('Recently crawled, %i documents: %s' %
+                             (len(cached_documents), page_url))
+            for document_url, index_url in cached_documents:
+                self.download_and_process_document(
+                    document_url, document_url.split('/')[-1], index_url)
+            return
+        found_documents = []
+        self.visits_in_progress.append(found_documents)
+        try:
+            crawl_function(page_url)
+        except RetriesExhausted as e:
+            # the page is dead-lettered; carry on with the rest of the crawl
+            self.logger.error('Skipping page %s: %s failed' % (page_url, e))
+            return
+        except ListingIncomplete as e:
+            # don't cache what we found, so the page is crawled again
+            self.logger.error('Listing failed on page %s: %s' % (page_url, e))
+            self.committee_incomplete = True
+            return
+        finally:
+            self.visits_in_progress.remove(found_documents)
+        self.frontier.store_documents(page_url, found_documents)
 
     def crawl_publications_section(self, publications_url):
         """Download from the top-level Publications section
@@ -94,6 +234,11 @@ class Downloader(object):
         try:
             sessions_filter = Select(
                 self.browser.find_element_by_class_name('ctlSession'))
+        except (NoSuchElementException, UnexpectedTagNameException):
+            self.logger.info('no publications drop-down processed')
+            return
+        urls = []
+        try:
             all_options = [pf.text for pf in sessions_filter.options]
             # before iterating through the filter options,
             # just take the top-level URLs listing
@@ -112,8 +257,12 @@ class Downloader(object):
                 urls = urls + [x.get_attribute('href') for x in
                                self.browser.find_elements_by_xpath(
                                    xp_publication_items)]
-        except:
-            logger.info('no publications drop-down processed')
+        except WebDriverException as e:
+            # e.g. a page load timed out: keep what we found, but the
+            # listing isn't complete
+            self.queue_oral_evidence_urls(urls, self.browser.current_url)
+            raise ListingIncomplete('publications drop-down: %s' % e)
+        self.queue_oral_evidence_urls(urls, self.browser.current_url)
 
 
     def crawl_inquiries_section(self, inquiries_url):
@@ -144,9 +293,9 @@ class Downloader(object):
                            self.browser.find_elements_by_xpath(
                                xp_historical_inquiries)]
 
-        logger.info("Found %i inquiries" % len(urls))
+        self.logger.info("Found %i inquiries" % len(urls))
         for i, url in enumerate(urls):
-            self.crawl_inquiry(url)
+            self.visit(url, self.crawl_inquiry)
         pass
 
 
@@ -158,16 +307,16 @@ class Downloader(object):
         :param inquiry_url: starting point for crawling
         """
         self.browser.set_page_load_timeout(60)
-        logger.info("Starting inquiry: %s" % inquiry_url)
+        self.logger.info("Starting inquiry: %s" % inquiry_url)
         self.browser_get(inquiry_url)
         pubs_links = self.browser.find_elements_by_link_text('Publications')
         if len(pubs_links) > 0:
             publications_url = pubs_links[0].get_attribute('href')
             self.browser_get(publications_url)
-            logger.info(
+            self.logger.info(
                 "Found a Publications page for the inquiry: %s" % inquiry_url)
         else:
-            logger.info(
+            self.logger.info(
                 "Found no Publications page for the inquiry: %s " % inquiry_url)
         # if there's a drop-down for 'publications types' then
         # select Oral Evidence (otherwise, just use the full list of
@@ -190,23 +339,12 @@ class Downloader(object):
 
 
     def browser_get(self, url):
-        """Access page URL in browser"""
-        retries = 0
-        success = False
-        while (not success) and (retries <= 10):
-            try:
-                self.browser.get(url)
-                success = True
-            except TimeoutException as e:
-                wait = (retries ^ 3) * 20
-                logger.warning(e)
-                logger.info('URL: %s' % url)
-                logger.info('Waiting %s secs and re-trying...' % wait)
-                sleep(wait)
-                retries += 1
-        if retries > 10:
-            logger.error('Download repeatedly failed: %s', url)
-            sys.exit('Download repeatedly failed: %s' % url)
+        """Access page URL in browser
+
+        :raises RetriesExhausted: if the page repeatedly fails to load
+        """
+        self.fetcher.scheduler.call(url, lambda: self.browser.get(url),
+                                    retry_on=(TimeoutException,))
 
     def capture_oral_evidence_urls_from_current_page(self):
         """Seek and download all oral evdience URLs on the current web page
@@ -226,61 +364,118 @@ class Downloader(object):
                 sleep(2)
             else:
                 break
-        logger.info("Found %i reports etc URLs" % len(all_urls))
+        self.queue_oral_evidence_urls(all_urls, self.browser.current_url)
+
+    def queue_oral_evidence_urls(self, all_urls, index_url):
+        """Download the oral evidence documents from a list of URLs
+
+        :param all_urls: URLs of all documents listed on an index page
+        :param index_url: URL of the index page
+        """
+        self.logger.info("Found %i reports etc URLs" % len(all_urls))
         oral_urls = [x for x in all_urls if
-                     re.match(r'.*oral/\d+.(html|pdf)$', x)]
-        logger.info("Found %i oral evidence URLs" % len(oral_urls))
+                     x and re.match(r'.*oral/\d+.(html|pdf)$', x)]
+        self.logger.info("Found %i oral evidence URLs" % len(oral_urls))
+        if not args.include_pdf:
+            oral_urls = skip_pdf_duplicates(oral_urls)
 
         for u in oral_urls:
             f = u.split('/')[-1]
-            self.download_and_process_document(u, f)
+            self.download_and_process_document(u, f, index_url)
 
-    def download_and_process_document(self, url, filename):
-        """Download and store a HTML or PDF document
+    def download_and_process_document(self, url, filename, index_url=None):
+        """Queue a HTML or PDF document for download and storage
 
+        The download itself runs on the fetcher's worker pool, so the crawl
+        can continue straight away.
         :param url: URL of the document
         :param filename: filesystem path where we wish to store the document
-        :return:
+        :param index_url: URL of the page listing the document (defaults to
+            the browser's current page)
+        :return: Future for the queued download (None if already queued)
         """
-        logger.info("Document: " + url)
-        retries = 0
-        success = False
-        filetype = filename.split('.')[1]
-        while (not success) and (retries <= 10):
+        for found_documents in self.visits_in_progress:
+            found_documents.append([url, index_url or
+                                    self.browser.current_url])
+        if not self.frontier.schedule(url):
+            # already queued by this or another browser
+            return None
+        source_document_locations = {'url_index': index_url or
+                                                  self.browser.current_url,
+                                     'url_document': url}
+        future = self.fetcher.submit(url, filename, source_document_locations)
+        self.committee_downloads.append(future)
+        return future
+
+
+def skip_pdf_duplicates(oral_urls):
+    """Drop PDF evidence documents which have a HTML version
+
+    The PDF files mostly duplicate the text of the HTML files, so we only
+    need a PDF when it's the only version of the document.
+    :param oral_urls: URLs of oral evidence HTML and PDF documents
+    :return: the URLs, less the PDFs with a HTML twin
+    """
+    html_ids = set()
+    for u in oral_urls:
+        if u.endswith('.html'):
+            html_ids.add(u.split('/')[-1].split('.')[0])
+    return [u for u in oral_urls if not (
+        u.endswith('.pdf') and u.split('/')[-1].split('.')[0] in html_ids)]
+
+
+def crawl_committees_in_parallel(downloader, committee_urls, n_browsers):
+    """Crawl committees with several browsers at once
+
+    Each worker thread drives its own headless browser, taking committees
+    from a shared queue until none are left. All workers share the
+    downloader's manifest, document fetcher and crawl frontier. If a browser
+    crashes, it is restarted and the committee is tried again.
+    :param downloader: Downloader, used as the first worker
+    :param committee_urls: URLs of committee homepages
+    :param n_browsers: number of browsers to run
+    """
+    committees_queue = queue.Queue()
+    for c in committee_urls:
+        committees_queue.put(c)
+
+    def worker(worker_downloader):
+        while True:
             try:
-                r = requests.get(url, timeout=20)
-                source_document_locations = {'url_index':
-                                                 self.browser.current_url,
-                                             'url_document': url}
-                if filetype == 'html':
-                    with open(os.path.join(self.storage_path,
-                                           filename),'w') as f:
-                        # address an apparent problem with encoding
-                        # on the Parliament html pages
-                        html_text = r.content.decode('utf-8')
-                        f.write(html_text)
-
-                    current_transcript = transcript(html_text,
-                                                    source_document_locations,
-                                                    filename)
-                    current_transcript.process_raw_html(parse_to_json=False)
-                elif filetype == 'pdf':
-                    with open(os.path.join(self.storage_path, filename),
-                              'wb') as f:
-                        f.write(r.content)
-                else:
-                    logger.error('Unknown filetype: %s, %s' % (url, filename))
-                success = True
-            except requests.exceptions.RequestException as e:
-                wait = (retries ^ 3) * 20
-                logger.warning(e)
-                logger.info('URL: %s' % url)
-                logger.info('Waiting %s secs and re-trying...' % wait)
-                sleep(wait)
-                retries += 1
-        if retries > 10:
-            logger.error('Download repeatedly failed: %s', url)
-            sys.exit('Download repeatedly failed: %s' % url)
+                committee_url = committees_queue.get_nowait()
+            except queue.Empty:
+                break
+            for attempt in range(3):
+                try:
+                    worker_downloader.capture_committee_documents(
+                        committee_url)
+                    break
+                except WebDriverException as e:
+                    worker_downloader.logger.error(
+                        'Browser failed on %s (attempt %i): %s' %
+                        (committee_url, attempt + 1, e))
+                    worker_downloader.restart_browser()
+            else:
+                worker_downloader.logger.error(
+                    'Giving up on committee: %s' % committee_url)
+            worker_downloader.logger.info(
+                'Completed committee, %i remaining' % committees_queue.qsize())
+
+    downloaders = [downloader] + \
+                  [type(downloader)(browser_id=i, headless=True,
+                                    shared_with=downloader)
+                   for i in range(1, n_browsers)]
+    threads = [threading.Thread(target=worker, args=(d,),
+                                name='browser-%i' % i)
+               for i, d in enumerate(downloaders)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    for d in downloaders[1:]:
+        d.close()
+    logger.info('Parallel crawl found %i oral evidence URLs' %
+                len(downloader.frontier.scheduled))
 
 
 def page_not_found(browser):
@@ -0,0 +1,228 @@
+import json
+import glob
+import os
+import re
+
+
+# columns of each table, with their Parquet types
+TABLES = {
+    'transcripts': [('document', 'string'), ('committee', 'string'),
+                    ('status', 'string'),
+                    ('url_document', 'string'), ('url_index', 'string'),
+                    ('members_text', 'string'), ('witnesses_text', 'string'),
+                    ('header_other_text', 'string'),
+                    ('n_people', 'int64'), ('n_sections', 'int64')],
+    'people': [('document', 'string'), ('person_key', 'string'),
+               ('name', 'string'), ('designation', 'string'),
+               ('speaker_type', 'string'), ('person_id', 'int64'),
+               ('canonical_id', 'int64')],
+    'speakers': [('document', 'string'), ('speaker_string', 'string'),
+                 ('speaker_name', 'string'), ('speaker_type', 'string'),
+                 ('canonical_id', 'int64'), ('label_count', 'int64'),
+                 ('fuzzy_match_score', 'int64')],
+    'sections': [('document', 'string'), ('section_id', 'int64'),
+                 ('question_number', 'string'),
+                 ('speaker_string', 'string'), ('speaker_name', 'string'),
+                 ('speaker_type', 'string'), ('canonical_id', 'int64'),
+                 ('fuzzy_match_score', 'int64'), ('spoken_text', 'string'),
+                 ('unparsed_text', 'string')],
+}
+
+
+def transcript_rows(trscrpt):
+    """Flatten a parsed transcript into rows of the corpus tables
+
+    :param trscrpt: transcript_data dict
+    :return: dict of table name to list of row dicts
+    """
+    document = trscrpt.get('html_file_location')
+    all_people = trscrpt.get('all_people', {})
+    all_sections = trscrpt.get('all_sections', [])
+    rows = {'transcripts': [{
+        'document': document,
+        'committee': committee_from_url(trscrpt.get('url_document')),
+        'status': trscrpt.get('status'),
+        'url_document': trscrpt.get('url_document'),
+        'url_index': trscrpt.get('url_index'),
+        'members_text': trscrpt.get('members_text'),
+        'witnesses_text': trscrpt.get('witnesses_text'),
+        'header_other_text': trscrpt.get('header_other_text'),
+        'n_people': len(all_people),
+        'n_sections': len(all_sections)}]}
+    rows['people'] = [{'document': document,
+                       'person_key': key,
+                       'name': p.get('name'),
+                       'designation': p.get('designation'),
+                       'speaker_type': p.get('speaker_type'),
+                       'person_id': p.get('id'),
+                       'canonical_id': p.get('canonical_id')}
+                      for key, p in all_people.items()]
+    rows['speakers'] = []
+    rows['sections'] = []
+    speaker_strings = set()
+    for s in all_sections:
+        person = s.get('speaker', {}).get('person', {})
+        if person and s['speaker_string'] not in speaker_strings:
+            # one row for each speaker label, from its speakers_dict entry
+            speaker_strings.add(s['speaker_string'])
+            rows['speakers'].append({
+                'document': document,
+                'speaker_string': s['speaker_string'],
+                'speaker_name': person.get('name'),
+                'speaker_type': person.get('speaker_type'),
+                'canonical_id': person.get('canonical_id'),
+                'label_count': s['speaker'].get('label_count'),
+                'fuzzy_match_score': s['speaker'].get('fuzzy_match_score')})
+        rows['sections'].append({
+            'document': document,
+            'section_id': s.get('section_id'),
+            'question_number': s.get('question_number'),
+            'speaker_string': s.get('speaker_string'),
+            'speaker_name': person.get('name'),
+            'speaker_type': person.get('speaker_type'),
+            'canonical_id': person.get('canonical_id'),
+            'fuzzy_match_score': s.get('speaker', {}).get(
+                'fuzzy_match_score'),
+            'spoken_text': s.get('spoken_text'),
+            'unparsed_text': s.get('unparsed_text')})
+    return rows
+
+
+class CorpusWriter(object):
+    """Write parsed transcripts as normalized tables
+
+    In 'parquet' format, each table is a folder of Parquet files
+    (corpus/sections/part-00000.parquet, ...), one file for each batch of
+    transcripts. In 'jsonl' format, the rows of all the tables go into a
+    single JSON Lines file, each tagged with its table's name. In 'sqlite'
+    format, they go into a TranscriptDB, where they replace any earlier
+    versions of the same transcripts. Either way, the whole corpus can be
+    read back with load_corpus_tables.
+    """
+    def __init__(self, path, table_format='parquet', batch_size=500):
+        """
+        :param path: folder for Parquet, or file name for JSON Lines or
+            SQLite
+        :param table_format: 'parquet', 'jsonl' or 'sqlite'
+        :param batch_size: transcripts per Parquet file or SQLite commit
+        """
+        self.path = path
+        self.table_format = table_format
+        self.batch_size = batch_size
+        self.batch = {table: [] for table in TABLES}
+        self.batch_rows = []
+        self.batch_transcripts = 0
+        self.parts = 0
+        # Parquet and JSON Lines start afresh: the tables are written for
+        # the whole corpus
+        if table_format == 'parquet':
+            for old_part in glob.glob(os.path.join(path, '*',
+                                                   'part-*.parquet')):
+                os.remove(old_part)
+        elif table_format == 'jsonl':
+            self.jsonl_file = open(path, 'w', encoding='utf-8')
+        else:
+            from .transcript_db import TranscriptDB
+            self.db = TranscriptDB(path)
+
+    def add(self, rows):
+        """Add the rows of a transcript, from transcript_rows"""
+        if self.table_format == 'jsonl':
+            for table, table_rows in rows.items():
+                for row in table_rows:
+                    self.jsonl_file.write(
+                        json.dumps(dict(row, table=table)) + '\n')
+            return
+        if self.table_format == 'sqlite':
+            self.batch_rows.append(rows)
+        else:
+            for table, table_rows in rows.items():
+                self.batch[table].extend(table_rows)
+        self.batch_transcripts += 1
+        if self.batch_transcripts >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.table_format == 'jsonl':
+            self.jsonl_file.flush()
+            return
+        if not self.batch_transcripts:
+            return
+        if self.table_format == 'sqlite':
+            self.db.add_transcripts(self.batch_rows)
+            self.batch_rows = []
+            self.batch_transcripts = 0
+            return
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        for table, columns in TABLES.items():
+            arrays = [pa.array([row.get(name) for row in self.batch[table]],
+                               type=getattr(pa, type_name)())
+                      for name, type_name in columns]
+            part_path = os.path.join(self.path, table,
+                                     'part-%05i.parquet' % self.parts)
+            os.makedirs(os.path.dirname(part_path), exist_ok=True)
+            pq.write_table(pa.Table.from_arrays(
+                arrays, names=[name for name, type_name in columns]),
+                part_path)
+            self.batch[table] = []
+        self.batch_transcripts = 0
+        self.parts += 1
+
+    def close(self):
+        self.flush()
+        if self.table_format == 'jsonl':
+            self.jsonl_file.close()
+
+
+def load_corpus_tables(path, table_format='parquet', tables=None):
+    """Read the tables written by CorpusWriter
+
+    :param path: folder for Parquet, or file name for JSON Lines or
+        SQLite
+    :param table_format: 'parquet', 'jsonl' or 'sqlite'
+    :param tables: names of the tables to read (default: all)
+    :return: dict of table name to DataFrame
+    """
+    import pandas as pd
+    tables = tables or list(TABLES)
+    if table_format == 'sqlite':
+        from .transcript_db import TranscriptDB
+        return TranscriptDB(path).read_tables(tables)
+    if table_format == 'parquet':
+        import pyarrow.parquet as pq
+        # an empty corpus has no parts to read
+        return {table: pq.read_table(os.path.join(path, table)).to_pandas()
+                if glob.glob(os.path.join(path, table, 'part-*.parquet'))
+                else empty_table(table)
+                for table in tables}
+    df = pd.read_json(path, lines=True, dtype=False, convert_dates=False)
+    if 'table' not in df.columns:
+        # no rows at all
+        return {table: empty_table(table) for table in tables}
+    return {table: df[df['table'] == table].reindex(
+                columns=[name for name, type_name in TABLES[table]])
+            .reset_index(drop=True)
+            for table in tables}
+
+
+def empty_table(table):
+    """DataFrame with a table's columns and no rows"""
+    import pandas as pd
+    return pd.DataFrame(columns=[name for name, type_name in TABLES[table]])
+
+
+def corpus_tables_path(storage_path, table_format):
+    """Where the corpus tables are written in the storage folder"""
+    return os.path.join(storage_path, {'parquet': 'corpus',
+                                       'jsonl': 'corpus.jsonl',
+                                       'sqlite': 'transcripts.sqlite'}
+                        [table_format])
+
+
+def committee_from_url(url):
+    """The committee's name in a document URL, e.g. 'treasury-committee'
+    in http://data.parliament.uk/writtenevidence/committeeevidence.svc/
+    evidencedocument/treasury-committee/monetary-policy/oral/3245.html"""
+    committee_search = re.search(r'/evidencedocument/([^/]+)/', url or '')
+    return committee_search.groups()[0] if committee_search else None
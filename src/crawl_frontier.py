@@ -0,0 +1,90 @@
+from .utils import logger
+
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from time import time
+import threading
+import json
+import os
+
+
+class CrawlFrontier(object):
+    """Persistent record of crawled listing pages and scheduled documents
+
+    Each listing page we crawl is stored with the time of the visit and the
+    documents found beneath it. Within the TTL, a repeat visit replays those
+    documents instead of loading the page again. Document URLs are
+    de-duplicated on their normalized form, so a document linked from
+    several pages is only scheduled once per crawl.
+    """
+    def __init__(self, storage_path, ttl_hours=24,
+                 filename='crawl_frontier.json', save_every=20):
+        self.path = os.path.join(storage_path, filename)
+        self.ttl = ttl_hours * 3600
+        self.save_every = save_every
+        self.lock = threading.RLock()
+        self.unsaved_changes = 0
+        self.pages = {}
+        self.scheduled = set()
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.pages = json.load(f).get('pages', {})
+            logger.info('Loaded crawl frontier: %i listing pages' %
+                        len(self.pages))
+
+    def cached_documents(self, page_url):
+        """Documents found beneath a listing page on a visit within the TTL
+
+        :return: list of [document URL, index page URL] pairs, or None if
+            the page must be crawled
+        """
+        with self.lock:
+            page = self.pages.get(normalize_url(page_url))
+            if page and time() - page['visited_at'] < self.ttl:
+                return page['documents']
+            return None
+
+    def store_documents(self, page_url, documents):
+        """Record a visit to a listing page, and the documents beneath it"""
+        with self.lock:
+            self.pages[normalize_url(page_url)] = {
+                'visited_at': time(),
+                'documents': documents}
+            self.unsaved_changes += 1
+            if self.unsaved_changes >= self.save_every:
+                self.save()
+
+    def schedule(self, document_url):
+        """Claim a document for download
+
+        :return: True the first time a document is scheduled in this crawl
+        """
+        key = normalize_url(document_url)
+        with self.lock:
+            if key in self.scheduled:
+                return False
+            self.scheduled.add(key)
+            return True
+
+    def save(self):
+        with self.lock:
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'pages': self.pages}, f)
+            os.replace(tmp_path, self.path)
+            self.unsaved_changes = 0
+
+
+def normalize_url(url):
+    """Canonical form of a URL for de-duplication: http and https are
+    treated alike, the host is lower-cased, and fragments, trailing slashes
+    and query parameter order are ignored"""
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    if scheme == 'https':
+        scheme = 'http'
+    netloc = parts.netloc.lower()
+    if netloc.endswith(':80') or netloc.endswith(':443'):
+        netloc = netloc.rsplit(':', 1)[0]
+    path = parts.path.rstrip('/') or '/'
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, netloc, path, query, ''))
@@ -0,0 +1,128 @@
+from .utils import args
+
+from datetime import datetime
+import threading
+import fnmatch
+import hashlib
+import sqlite3
+import glob
+import gzip
+import os
+import re
+
+
+class DocumentStore(object):
+    """Compressed, content-addressed storage for documents
+
+    Documents are stored gzip-compressed, named by the SHA-1 of their
+    content and sharded into subdirectories (objects/ab/cd/abcd....gz), so
+    identical content is only stored once. An SQLite index maps document
+    names (e.g. '12345.html') to content hashes, and is safe to share
+    between threads and worker processes.
+
+    Documents saved as plain files in the storage folder by earlier versions
+    can still be read, and are included in names().
+    """
+    def __init__(self, storage_path, index_filename='store_index.sqlite'):
+        self.storage_path = storage_path
+        self.objects_path = os.path.join(storage_path, 'objects')
+        self.index_path = os.path.join(storage_path, index_filename)
+        self.lock = threading.Lock()
+        self._connection = None
+        self._connection_pid = None
+
+    @property
+    def connection(self):
+        # one connection per process: SQLite connections must not be
+        # carried across a fork
+        if self._connection_pid != os.getpid():
+            self._connection = sqlite3.connect(self.index_path, timeout=60,
+                                               check_same_thread=False)
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS documents ('
+                'name TEXT PRIMARY KEY, sha1 TEXT, size INTEGER, '
+                'stored_at TEXT)')
+            self._connection_pid = os.getpid()
+        return self._connection
+
+    def object_path(self, sha1):
+        return os.path.join(self.objects_path, sha1[0:2], sha1[2:4],
+                            sha1 + '.gz')
+
+    def put(self, name, content):
+        """Store a document
+
+        :param name: document name, e.g. '12345.html'
+        :param content: bytes, or str which is stored as UTF-8
+        :return: SHA-1 of the content
+        """
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        sha1 = hashlib.sha1(content).hexdigest()
+        path = self.object_path(sha1)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = '%s.%i.%i.tmp' % (path, os.getpid(),
+                                        threading.get_ident())
+            with gzip.open(tmp_path, 'wb') as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        with self.lock:
+            with self.connection:
+                self.connection.execute(
+                    'INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?)',
+                    (name, sha1, len(content),
+                     datetime.utcnow().strftime('%Y%m%d %H:%M:%S')))
+        return sha1
+
+    def sha1(self, name):
+        """Content hash of a stored document, or None if not in the index"""
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT sha1 FROM documents WHERE name = ?',
+                (name,)).fetchone()
+        return row[0] if row else None
+
+    def exists(self, name):
+        return self.sha1(name) is not None or \
+            os.path.exists(os.path.join(self.storage_path, name))
+
+    def get(self, name):
+        """Content of a document, as bytes
+
+        :raises FileNotFoundError: if there's no such document
+        """
+        sha1 = self.sha1(name)
+        if sha1:
+            with gzip.open(self.object_path(sha1), 'rb') as f:
+                return f.read()
+        with open(os.path.join(self.storage_path, name), 'rb') as f:
+            return f.read()
+
+    def get_text(self, name):
+        return self.get(name).decode('utf-8')
+
+    def names(self, pattern='*'):
+        """Sorted names of all stored documents matching a glob pattern,
+        e.g. '*.html'"""
+        with self.lock:
+            names = set(n for (n,) in self.connection.execute(
+                'SELECT name FROM documents'))
+        names = set(fnmatch.filter(names, pattern))
+        # plain files from earlier versions: evidence documents are named
+        # by their number, unlike the crawler's own manifest files etc.
+        names.update(os.path.basename(p) for p in
+                     glob.glob(os.path.join(self.storage_path, pattern))
+                     if re.match(r'\d+\.\w+$', os.path.basename(p)))
+        return sorted(names)
+
+
+_stores = {}
+
+
+def document_store(storage_path=None):
+    """Shared DocumentStore for a storage folder (default: --storage)"""
+    storage_path = storage_path or args.storage
+    if storage_path not in _stores:
+        _stores[storage_path] = DocumentStore(storage_path)
+    return _stores[storage_path]
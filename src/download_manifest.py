@@ -0,0 +1,137 @@
+from .utils import logger
+
+from datetime import datetime
+import threading
+import hashlib
+import json
+import os
+
+
+class DownloadManifest(object):
+    """Persistent record of downloaded documents and crawled committees
+
+    For each document URL we keep the local filename, a hash of the content,
+    the server's ETag/Last-Modified headers and the time of the last fetch.
+    Committees are checkpointed as their crawl completes, so an interrupted
+    crawl can resume where it stopped.
+    """
+    def __init__(self, storage_path, filename='download_manifest.json',
+                 save_every=20):
+        self.path = os.path.join(storage_path, filename)
+        self.save_every = save_every
+        self.lock = threading.RLock()
+        self.unsaved_changes = 0
+        self.documents = {}
+        self.completed_committees = {}
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.documents = data.get('documents', {})
+            self.completed_committees = data.get('completed_committees', {})
+            logger.info('Loaded download manifest: %i documents, '
+                        '%i completed committees' %
+                        (len(self.documents), len(self.completed_committees)))
+
+    def document(self, url):
+        """Manifest entry for a document URL, or None if never fetched"""
+        with self.lock:
+            entry = self.documents.get(url)
+            return entry.copy() if entry else None
+
+    def conditional_headers(self, url):
+        """HTTP headers for a conditional GET of a previously fetched URL"""
+        headers = {}
+        entry = self.document(url)
+        if entry:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def record_document(self, url, filename, content, response_headers):
+        """Store the details of a freshly downloaded document
+
+        :param content: raw bytes of the document, used for the content hash
+        :param response_headers: headers of the HTTP response
+        """
+        with self.lock:
+            self.documents[url] = {
+                'filename': filename,
+                'sha1': content_hash(content),
+                'etag': response_headers.get('ETag'),
+                'last_modified': response_headers.get('Last-Modified'),
+                'fetched_at': timestamp(),
+                'checked_at': timestamp()}
+            self._changed()
+
+    def record_stored_document(self, url, filename, content):
+        """Enter a document which was already in storage, but was never
+        recorded here (e.g. downloaded before there was a manifest)
+
+        :param content: raw bytes of the stored document
+        """
+        with self.lock:
+            # no ETag or Last-Modified, so a --refresh fetches it in full
+            # once, and compares the content hash
+            self.documents[url] = {
+                'filename': filename,
+                'sha1': content_hash(content),
+                'etag': None,
+                'last_modified': None,
+                'fetched_at': None,
+                'checked_at': timestamp()}
+            self._changed()
+
+    def document_urls(self):
+        """dict of each downloaded document's filename to its URL"""
+        with self.lock:
+            return {entry['filename']: url
+                    for url, entry in self.documents.items()}
+
+    def touch_document(self, url):
+        """Record that a document was checked and found to be unchanged"""
+        with self.lock:
+            if url in self.documents:
+                self.documents[url]['checked_at'] = timestamp()
+                self._changed()
+
+    def is_committee_complete(self, committee_url):
+        with self.lock:
+            return committee_url in self.completed_committees
+
+    def mark_committee_complete(self, committee_url):
+        with self.lock:
+            self.completed_committees[committee_url] = timestamp()
+            self.save()
+
+    def reset_committees(self):
+        """Clear the committee checkpoints, ready for a fresh crawl"""
+        with self.lock:
+            self.completed_committees = {}
+            self.save()
+
+    def _changed(self):
+        self.unsaved_changes += 1
+        if self.unsaved_changes >= self.save_every:
+            self.save()
+
+    def save(self):
+        """Write the manifest to disk (via a temporary file, so that an
+        interrupted write can't corrupt the existing manifest)"""
+        with self.lock:
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'documents': self.documents,
+                           'completed_committees': self.completed_committees},
+                          f)
+            os.replace(tmp_path, self.path)
+            self.unsaved_changes = 0
+
+
+def content_hash(content):
+    return hashlib.sha1(content).hexdigest()
+
+
+def timestamp():
+    return datetime.utcnow().strftime('%Y%m%d %H:%M:%S')
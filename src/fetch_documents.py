@@ -0,0 +1,215 @@
+from .utils import args, logger
+from .download_manifest import DownloadManifest, content_hash
+from .retry import RetryScheduler, RetriesExhausted
+from .document_store import document_store
+
+from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.parse import urlparse
+from time import sleep, time
+import threading
+import requests
+
+
+class HostLimiter(object):
+    """Limit the number of simultaneous requests, and the request rate,
+    for a single host"""
+    def __init__(self, max_concurrent, max_rate):
+        self.semaphore = threading.BoundedSemaphore(max_concurrent)
+        self.min_interval = 1.0 / max_rate if max_rate else 0
+        self.lock = threading.Lock()
+        self.next_slot = 0
+
+    def __enter__(self):
+        self.semaphore.acquire()
+        # reserve the next free time slot for this host, then wait for it
+        with self.lock:
+            now = time()
+            wait_time = self.next_slot - now
+            self.next_slot = max(now, self.next_slot) + self.min_interval
+        if wait_time > 0:
+            sleep(wait_time)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.semaphore.release()
+
+
+class DocumentFetcher(object):
+    """Download documents on a pool of worker threads
+
+    All workers share one keep-alive requests session, so connections to the
+    Parliament servers are re-used between documents. The crawler queues
+    URLs with submit() and carries on crawling while the downloads run.
+    Downloaded HTML is handed on to the parse pipeline for conversion.
+    """
+    def __init__(self, pipeline, storage_path=None, workers=None,
+                 host_concurrency=None, host_rate=None, manifest=None):
+        self.pipeline = pipeline
+        self.storage_path = storage_path or args.storage
+        self.manifest = manifest or DownloadManifest(self.storage_path)
+        self.store = document_store(self.storage_path)
+        self.workers = workers or args.download_workers
+        self.host_concurrency = host_concurrency or args.host_concurrency
+        self.host_rate = host_rate or args.host_rate
+
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=10,
+                                                pool_maxsize=self.workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        self.scheduler = RetryScheduler(self.storage_path,
+                                        max_concurrency=self.workers)
+        self.host_limiters = {}
+        self.lock = threading.Lock()
+        self.pending = set()
+
+    def host_limiter(self, url):
+        host = urlparse(url).netloc
+        with self.lock:
+            if host not in self.host_limiters:
+                self.host_limiters[host] = HostLimiter(self.host_concurrency,
+                                                       self.host_rate)
+            return self.host_limiters[host]
+
+    def submit(self, url, filename, source_document_locations):
+        """Queue a document for download, and return immediately
+
+        :param url: URL of the document
+        :param filename: filename under storage_path for the document
+        :param source_document_locations: dict of index page and document URLs
+        :return: Future for the download
+        """
+        future = self.executor.submit(self.download_and_process_document,
+                                      url, filename,
+                                      source_document_locations)
+        with self.lock:
+            self.pending.add(future)
+        future.add_done_callback(self._download_done)
+        return future
+
+    def _download_done(self, future):
+        with self.lock:
+            self.pending.discard(future)
+        if future.exception() is not None:
+            logger.error('Download worker failed: %s' % future.exception())
+
+    def on_complete(self, futures, callback):
+        """Call callback(all_succeeded) once all the futures have finished
+
+        :param futures: Futures returned by submit()
+        :param callback: function taking a single boolean argument
+        """
+        futures = list(futures)
+        remaining = [len(futures)]
+        lock = threading.Lock()
+
+        def one_done(_):
+            with lock:
+                remaining[0] -= 1
+                finished = remaining[0] == 0
+            if finished:
+                callback(all(f.exception() is None and f.result()
+                             for f in futures))
+
+        if not futures:
+            callback(True)
+        for f in futures:
+            f.add_done_callback(one_done)
+
+    def already_stored(self, url, filename):
+        """Is the document already in storage, from an earlier download?
+
+        Documents in storage but not in the download manifest, from before
+        there was one, are entered in the manifest from their stored
+        content rather than downloaded again.
+        """
+        if not self.store.exists(filename):
+            return False
+        if self.manifest.document(url) is None:
+            self.manifest.record_stored_document(url, filename,
+                                                 self.store.get(filename))
+        return True
+
+    def download_and_process_document(self, url, filename,
+                                      source_document_locations):
+        """Download and store a HTML or PDF document
+
+        :param url: URL of the document
+        :param filename: filesystem path where we wish to store the document
+        :param source_document_locations: dict of index page and document URLs
+        :return: True if the document was stored
+        """
+        already_stored = self.already_stored(url, filename)
+        if already_stored and not args.refresh:
+            logger.debug("Already downloaded: " + url)
+            return True
+
+        logger.info("Document: " + url)
+        # only ask for the document if it changed since our last fetch
+        headers = self.manifest.conditional_headers(url) \
+            if already_stored else {}
+
+        def get_document():
+            with self.host_limiter(url):
+                r = self.session.get(url, timeout=20, headers=headers)
+            if r.status_code >= 500:
+                # server errors count towards the circuit breaker
+                r.raise_for_status()
+            return r
+
+        try:
+            r = self.scheduler.call(url, get_document,
+                                    retry_on=(requests.exceptions.RequestException,))
+        except RetriesExhausted:
+            return False
+        return self.store_document(url, filename, r.status_code, r.content,
+                                   r.headers, already_stored,
+                                   source_document_locations)
+
+    def store_document(self, url, filename, status_code, content,
+                       response_headers, already_stored,
+                       source_document_locations):
+        """Store a downloaded document and queue HTML for parsing
+
+        :return: True if the document is now stored
+        """
+        if status_code == 304 or (
+                already_stored and
+                self.manifest.document(url)['sha1'] == content_hash(content)):
+            logger.debug("Unchanged: " + url)
+            self.manifest.touch_document(url)
+            return True
+        if status_code != 200:
+            logger.error('HTTP %i for document: %s' % (status_code, url))
+            return False
+
+        filetype = filename.split('.')[1]
+        if filetype == 'html':
+            # address an apparent problem with encoding
+            # on the Parliament html pages
+            html_text = content.decode('utf-8')
+            self.store.put(filename, html_text)
+            self.pipeline.put(html_text, source_document_locations, filename)
+        elif filetype == 'pdf':
+            self.store.put(filename, content)
+        else:
+            logger.error('Unknown filetype: %s, %s' % (url, filename))
+        self.manifest.record_document(url, filename, content, response_headers)
+        return True
+
+    def wait(self):
+        """Block until every queued download has finished"""
+        while True:
+            with self.lock:
+                pending = list(self.pending)
+            if not pending:
+                break
+            wait(pending)
+
+    def shutdown(self):
+        """Finish outstanding downloads and release the worker threads"""
+        self.wait()
+        self.executor.shutdown(wait=True)
+        self.session.close()
+        self.manifest.save()
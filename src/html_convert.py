@@ -0,0 +1,256 @@
+import re
+
+
+BLOCK_TAGS = {'p', 'div', 'table', 'ul', 'ol', 'dl', 'dt', 'dd',
+              'blockquote', 'section', 'article', 'header', 'footer',
+              'address', 'center', 'form', 'pre'}
+SKIPPED_TAGS = {'head', 'script', 'style', 'title', 'img', 'noscript'}
+BOLD_TAGS = {'strong', 'b'}
+ITALIC_TAGS = {'em', 'i', 'u'}
+BOLD = '**'
+ITALIC = '_'
+
+
+def html_to_markdown(raw_html):
+    """Convert HTML to plain text with html2text-style emphasis markup
+
+    A faster alternative to html2text (see utils.html_to_txt) built on
+    lxml. Bold text (<b>, <strong>, or a bold font-weight style) is marked
+    **bold**, and italic text (<i>, <em>, <u> or an italic font-style) is
+    marked _italic_, which is what parse_panel and parse_qna_lines look for
+    to find speakers. As with html_to_txt, emphasis marks enclose the
+    text without its surrounding spaces, empty emphasis is dropped and
+    adjacent runs of the same emphasis are joined. Paragraphs are separated
+    by a line break, links are written [text](url), and images are left
+    out. Unlike html2text, markdown characters are not escaped.
+
+    :param raw_html: HTML document, as str or bytes
+    :return: plain text
+    """
+    import lxml.html
+    import lxml.etree
+    if isinstance(raw_html, str):
+        # lxml won't parse str with an XML encoding declaration
+        raw_html = raw_html.encode('utf-8')
+    try:
+        root = lxml.html.document_fromstring(
+            raw_html, parser=lxml.html.HTMLParser(encoding='utf-8'))
+    except (lxml.etree.ParserError, ValueError):
+        return ''
+    events = []
+    add_element_events(root, events, [], in_heading=False)
+    return render(events)
+
+
+def add_element_events(element, events, list_stack, in_heading):
+    """Walk an lxml element and its children, adding the events for the
+    text, emphasis and line breaks to the events list"""
+    tag = element.tag if isinstance(element.tag, str) else None
+    if tag is None or tag in SKIPPED_TAGS:
+        # comments, processing instructions, or content we don't show
+        add_text(events, element.tail)
+        return
+    tag = tag.lower()
+
+    heading_level = int(tag[1]) if re.match(r'h[1-9]$', tag) else 0
+    marks = [] if in_heading or heading_level else emphasis_marks(element,
+                                                                   tag)
+
+    link = None
+    if tag == 'a' and element.get('href') and \
+            not element.get('href').startswith('#'):
+        link = element.get('href')
+        if element.text_content().strip() == link and \
+                re.match(r'https?://', link):
+            # html2text writes a link with its own url as text as <url>
+            events.append(('literal', '<%s>' % link))
+            add_text(events, element.tail)
+            return
+
+    if heading_level:
+        events.append(('break', 2))
+        events.append(('literal', '#' * heading_level + ' '))
+    elif tag in BLOCK_TAGS or tag == 'tr':
+        events.append(('break', 1))
+    elif tag == 'li':
+        events.append(('break', 1))
+        events.append(('literal', '  ' * max(len(list_stack), 1) +
+                       ('%i. ' % next_list_number(list_stack)
+                        if list_stack and list_stack[-1][0] == 'ol'
+                        else '* ')))
+    elif tag in ('td', 'th') and element.getprevious() is not None:
+        events.append(('literal', ' | '))
+    elif tag == 'br':
+        events.append(('break', 1))
+    elif tag == 'hr':
+        events.append(('break', 2))
+        events.append(('literal', '* * *'))
+        events.append(('break', 2))
+
+    if link:
+        events.append(('literal', '['))
+    for m in marks:
+        events.append(('open', m))
+
+    if tag in ('ul', 'ol'):
+        list_stack.append([tag, 0])
+    add_text(events, element.text)
+    for child in element:
+        add_element_events(child, events, list_stack,
+                           in_heading or bool(heading_level))
+    if tag in ('ul', 'ol'):
+        list_stack.pop()
+
+    for m in reversed(marks):
+        events.append(('close', m))
+    if link:
+        events.append(('literal', '](%s)' % link))
+
+    if heading_level:
+        events.append(('break', 2))
+    elif tag in BLOCK_TAGS or tag == 'tr':
+        events.append(('break', 1))
+    add_text(events, element.tail)
+
+
+def add_text(events, text):
+    if text:
+        events.append(('text', re.sub(r'\s+', ' ', text)))
+
+
+def next_list_number(list_stack):
+    list_stack[-1][1] += 1
+    return list_stack[-1][1]
+
+
+def emphasis_marks(element, tag):
+    """Emphasis marks for an element, from its tag and its style"""
+    marks = []
+    style = element.get('style', '').lower()
+    if tag in ITALIC_TAGS or \
+            re.search(r'font-style\s*:\s*italic', style):
+        marks.append(ITALIC)
+    if tag in BOLD_TAGS or \
+            re.search(r'font-weight\s*:\s*(bold|[6-9]00)', style):
+        marks.append(BOLD)
+    return marks
+
+
+def render(events):
+    """Join up the events of add_element_events into text
+
+    Emphasis marks are only written next to the text they enclose: an
+    emphasis which is still open when the next text comes along is carried
+    on rather than closed and reopened, and one which encloses no text is
+    never written at all. Emphasis is closed at the end of each line.
+    """
+    out = []
+    written = []  # emphasis marks open in the output
+    wanted = []  # emphasis marks open in the HTML
+    space = False
+    newlines = 0
+    at_start = True
+    for kind, value in events:
+        if kind == 'open':
+            wanted.append(value)
+        elif kind == 'close':
+            # remove the innermost matching mark
+            del wanted[len(wanted) - 1 - wanted[::-1].index(value)]
+        elif kind == 'break':
+            newlines = max(newlines, value)
+        else:
+            if kind == 'text':
+                if value.startswith(' '):
+                    space = True
+                text = value.strip()
+                if not text:
+                    continue
+            else:
+                text = value
+            marks = []
+            for m in wanted:
+                if m not in marks:
+                    marks.append(m)
+            keep = 0
+            if not newlines or at_start:
+                while keep < min(len(written), len(marks)) and \
+                        written[keep] == marks[keep]:
+                    keep += 1
+            out.extend(reversed(written[keep:]))
+            if not at_start:
+                if newlines:
+                    out.append('\n' * newlines)
+                elif space:
+                    out.append(' ')
+            out.extend(marks[keep:])
+            out.append(text)
+            written = marks
+            space = kind == 'text' and value.endswith(' ')
+            newlines = 0
+            at_start = False
+    out.extend(reversed(written))
+    return ''.join(out) + '\n'
+
+
+def compare_with_html2text(html_names, store):
+    """Check html_to_markdown against html2text on stored documents
+
+    Compares the text of each document, and the question numbers and
+    speakers that parse_qna_lines finds in it, logging any differences.
+
+    :param html_names: names of HTML documents in the store
+    :param store: DocumentStore
+    :return: dict of summary statistics
+    """
+    import difflib
+    import time
+    from .utils import logger, html2text_to_txt
+    from .parse_text import parse_sections, parse_panel, parse_qna_lines
+
+    def speakers(plain_text):
+        header_text, panels_sections = parse_sections(plain_text)
+        qna_text = ''
+        for panel_text in panels_sections:
+            witness_line, panel_qna_text = parse_panel(panel_text)
+            if panel_qna_text:
+                qna_text = qna_text + panel_qna_text + '\n'
+        return [(s.get('question_number'), s['speaker_string'])
+                for s in parse_qna_lines(qna_text) if 'speaker_string' in s]
+
+    def words(plain_text):
+        # ignore the markdown escapes which only html2text adds
+        return re.sub(r'\\([\\.+\-#*_\[\]()`!])', r'\1', plain_text).split()
+
+    summary = {'documents': 0, 'same_speakers': 0,
+               'html2text_secs': 0.0, 'lxml_secs': 0.0, 'text_ratio': 0.0}
+    for name in html_names:
+        raw_html = store.get_text(name)
+        start = time.time()
+        old_text = html2text_to_txt(raw_html)
+        summary['html2text_secs'] += time.time() - start
+        start = time.time()
+        new_text = html_to_markdown(raw_html)
+        summary['lxml_secs'] += time.time() - start
+
+        ratio = difflib.SequenceMatcher(None, words(old_text),
+                                        words(new_text)).ratio()
+        old_speakers, new_speakers = speakers(old_text), speakers(new_text)
+        summary['documents'] += 1
+        summary['text_ratio'] += ratio
+        if old_speakers == new_speakers:
+            summary['same_speakers'] += 1
+        else:
+            logger.warning('%s: %i speaker labels with html2text, %i with '
+                           'lxml, first difference: %s' % (
+                               name, len(old_speakers), len(new_speakers),
+                               next((pair for pair in
+                                     zip(old_speakers, new_speakers)
+                                     if pair[0] != pair[1]), None)))
+        logger.info('%s: text similarity %.3f' % (name, ratio))
+    if summary['documents']:
+        summary['text_ratio'] /= summary['documents']
+    logger.info('Compared %(documents)i documents: same speakers in '
+                '%(same_speakers)i, mean text similarity %(text_ratio).3f, '
+                'html2text %(html2text_secs).1fs, lxml %(lxml_secs).1fs'
+                % summary)
+    return summary
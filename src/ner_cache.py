@@ -0,0 +1,120 @@
+from collections import namedtuple, OrderedDict
+import threading
+import sqlite3
+import json
+import os
+
+
+FragmentToken = namedtuple('FragmentToken', ['text', 'pos_', 'ent_type_'])
+FragmentEntity = namedtuple('FragmentEntity', ['text', 'label_'])
+
+
+class FragmentAnalysis(object):
+    """The parts of a spaCy Doc that people_from_text reads: each token's
+    text, part of speech and entity type, and the entities found. Iterate
+    over it for the tokens, as with a Doc."""
+    def __init__(self, tokens, ents):
+        self.tokens = [FragmentToken(*t) for t in tokens]
+        self.ents = [FragmentEntity(*e) for e in ents]
+
+    def __iter__(self):
+        return iter(self.tokens)
+
+    @classmethod
+    def from_doc(cls, doc):
+        return cls([(t.text, t.pos_, t.ent_type_) for t in doc],
+                   [(e.text, e.label_) for e in doc.ents])
+
+    def to_json(self):
+        return json.dumps([[list(t) for t in self.tokens],
+                           [list(e) for e in self.ents]])
+
+    @classmethod
+    def from_json(cls, json_text):
+        return cls(*json.loads(json_text))
+
+
+class NerCache(object):
+    """Memoize the spaCy analysis of short text fragments
+
+    The same committee members and witnesses appear in thousands of
+    transcripts, so most name fragments have been seen before. Results are
+    kept in an in-memory LRU, and optionally in an SQLite database shared
+    across runs and worker processes. Entries are keyed on the model name
+    and version as well as the text, so a new model starts a fresh cache.
+    """
+    def __init__(self, nlp, db_path=None, max_memory_entries=100000,
+                 batch_size=64):
+        self.nlp = nlp
+        self.model_key = '%s_%s-%s/%s' % (
+            nlp.meta.get('lang'), nlp.meta.get('name'),
+            nlp.meta.get('version'), ','.join(nlp.pipe_names))
+        self.db_path = db_path
+        self.max_memory_entries = max_memory_entries
+        self.batch_size = batch_size
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self._connection = None
+        self._connection_pid = None
+
+    @property
+    def connection(self):
+        # one connection per process: SQLite connections must not be
+        # carried across a fork
+        if self._connection_pid != os.getpid():
+            self._connection = sqlite3.connect(self.db_path, timeout=60,
+                                               check_same_thread=False)
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS fragments ('
+                'model TEXT, fragment TEXT, analysis TEXT, '
+                'PRIMARY KEY (model, fragment))')
+            self._connection_pid = os.getpid()
+        return self._connection
+
+    def analyse(self, fragments):
+        """spaCy analysis of each fragment, from the cache where possible
+
+        :param fragments: list of strings
+        :return: list of FragmentAnalysis, in the same order
+        """
+        results = {}
+        with self.lock:
+            for f in fragments:
+                if f in self.memory:
+                    self.memory.move_to_end(f)
+                    results[f] = self.memory[f]
+        misses = [f for f in dict.fromkeys(fragments) if f not in results]
+
+        if misses and self.db_path:
+            with self.lock:
+                for f in misses:
+                    row = self.connection.execute(
+                        'SELECT analysis FROM fragments '
+                        'WHERE model = ? AND fragment = ?',
+                        (self.model_key, f)).fetchone()
+                    if row:
+                        results[f] = FragmentAnalysis.from_json(row[0])
+            self._remember({f: results[f] for f in misses if f in results})
+            misses = [f for f in misses if f not in results]
+
+        if misses:
+            new_results = {f: FragmentAnalysis.from_doc(doc) for f, doc in
+                           zip(misses, self.nlp.pipe(
+                               misses, batch_size=self.batch_size))}
+            results.update(new_results)
+            self._remember(new_results)
+            if self.db_path:
+                with self.lock:
+                    with self.connection:
+                        self.connection.executemany(
+                            'INSERT OR REPLACE INTO fragments '
+                            'VALUES (?, ?, ?)',
+                            [(self.model_key, f, a.to_json())
+                             for f, a in new_results.items()])
+        return [results[f] for f in fragments]
+
+    def _remember(self, analyses):
+        with self.lock:
+            self.memory.update(analyses)
+            while len(self.memory) > self.max_memory_entries:
+                self.memory.popitem(last=False)
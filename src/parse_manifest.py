@@ -0,0 +1,190 @@
+from .utils import logger, args
+
+from datetime import datetime
+import threading
+import hashlib
+import inspect
+import json
+import os
+import re
+
+
+# modules whose code decides what --parse makes of a document (including
+# the rows it writes to the corpus tables)
+PARSER_MODULES = ['parse_text', 'segment_text', 'speaker_matcher',
+                  'person_registry', 'html_convert', 'ner_cache',
+                  'corpus_tables', 'transcript_db']
+# and what --diagnostic makes of a parsed document
+ANALYSIS_MODULES = ['analyse_transcript', 'readability']
+
+
+class ParseManifest(object):
+    """Persistent record of what --parse and --diagnostic have done
+
+    For each HTML document we keep the hash of its content, the version of
+    the parser that parsed it (see parser_version) and the names and hashes
+    of the outputs saved, so that a later run only redoes the documents
+    which are new, have changed, were parsed by a different parser, or have
+    lost their outputs. For each JSON document we keep the speaker
+    statistics that --diagnostic found, in the same way.
+    """
+    def __init__(self, storage_path, filename='parse_manifest.json',
+                 save_every=100):
+        self.path = os.path.join(storage_path, filename)
+        self.save_every = save_every
+        self.lock = threading.RLock()
+        self.unsaved_changes = 0
+        self.documents = {}
+        self.analyses = {}
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.documents = data.get('documents', {})
+            self.analyses = data.get('analyses', {})
+            logger.info('Loaded parse manifest: %i parsed documents, '
+                        '%i analysed' % (len(self.documents),
+                                         len(self.analyses)))
+
+    def is_current(self, html_filename, html_sha1, version, outputs, store):
+        """Whether a document's saved outputs are up to date
+
+        :param html_sha1: hash of the document's HTML as it is now
+        :param version: parser_version() of the parser as it is now
+        :param outputs: per-document outputs wanted, 'txt' and/or 'json'
+        :param store: DocumentStore the outputs were saved in
+        :return: True if the document was last parsed from the same HTML by
+            the same parser, and the outputs it saved are still there
+        """
+        with self.lock:
+            entry = self.documents.get(html_filename)
+        if not entry or entry['html_sha1'] != html_sha1 or \
+                entry['parser_version'] != version:
+            return False
+        for output in outputs:
+            saved = entry['outputs'].get(output)
+            if not saved or store.sha1(saved['name']) != saved['sha1']:
+                return False
+        return True
+
+    def saved_outputs(self, html_filename):
+        """dict of the outputs recorded for a document, e.g.
+        {'json': {'name': '12345.json', 'sha1': ...}}"""
+        with self.lock:
+            entry = self.documents.get(html_filename)
+            return dict(entry['outputs']) if entry else {}
+
+    def record_parse(self, html_filename, html_sha1, version, outputs):
+        """Record that a document has been parsed
+
+        :param outputs: dict of each output saved to its location, e.g.
+            {'txt': {'name': '12345.txt', 'sha1': ...},
+             'tables': {'format': 'sqlite', 'path': ...}}
+        """
+        with self.lock:
+            self.documents[html_filename] = {'html_sha1': html_sha1,
+                                             'parser_version': version,
+                                             'outputs': outputs,
+                                             'parsed_at': timestamp()}
+            self._changed()
+
+    def analysis(self, json_filename, json_sha1, version):
+        """Speaker statistics rows saved by record_analysis, or None if
+        the JSON document or the analysis have changed since"""
+        with self.lock:
+            entry = self.analyses.get(json_filename)
+        if not entry or entry['json_sha1'] != json_sha1 or \
+                entry['analysis_version'] != version:
+            return None
+        return entry['rows']
+
+    def record_analysis(self, json_filename, json_sha1, version, rows):
+        """Record the speaker statistics found in a JSON document
+
+        :param rows: list of dicts, one per witness
+        """
+        with self.lock:
+            self.analyses[json_filename] = {'json_sha1': json_sha1,
+                                            'analysis_version': version,
+                                            'rows': rows,
+                                            'analysed_at': timestamp()}
+            self._changed()
+
+    def _changed(self):
+        self.unsaved_changes += 1
+        if self.unsaved_changes >= self.save_every:
+            self.save()
+
+    def save(self):
+        """Write the manifest to disk (via a temporary file, so that an
+        interrupted write can't corrupt the existing manifest)"""
+        with self.lock:
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'documents': self.documents,
+                           'analyses': self.analyses}, f,
+                          default=json_value)
+            os.replace(tmp_path, self.path)
+            self.unsaved_changes = 0
+
+
+def parser_version():
+    """Version of everything that decides what --parse makes of a
+    document: a hash of the parser's code, the spaCy model's version, the
+    HTML engine, and the generation of the person registry (whose
+    canonical ids go into the outputs)"""
+    from . import utils
+    from .parse_text import get_person_registry
+    code_hash = modules_hash(PARSER_MODULES, [utils.html_to_txt,
+                                              utils.html2text_to_txt])
+    return 'parser=%s model=en_core_web_sm-%s html_engine=%s-%s ' \
+        'registry=%s' % (code_hash, package_version('en_core_web_sm'),
+                         args.html_engine, package_version(args.html_engine),
+                         get_person_registry().generation())
+
+
+def analysis_version():
+    """Version of everything that decides what --diagnostic makes of a
+    parsed document"""
+    return 'analysis=%s textstat-%s pyphen-%s' % (
+        modules_hash(ANALYSIS_MODULES), package_version('textstat'),
+        package_version('pyphen'))
+
+
+def modules_hash(module_names, functions=()):
+    """Hash of the code of some of our modules, and of some functions"""
+    sha1 = hashlib.sha1()
+    for module_name in module_names:
+        with open(os.path.join(os.path.dirname(__file__),
+                               module_name + '.py'), 'rb') as f:
+            sha1.update(f.read())
+    for function in functions:
+        sha1.update(inspect.getsource(function).encode('utf-8'))
+    return sha1.hexdigest()[:12]
+
+
+def package_version(name):
+    try:
+        import pkg_resources
+        return pkg_resources.get_distribution(name).version
+    except Exception:
+        return 'unknown'
+
+
+def document_sha1(store, name):
+    """Hash of a stored document's content"""
+    return store.sha1(name) or hashlib.sha1(store.get(name)).hexdigest()
+
+
+def output_name(html_filename, output):
+    """Name of a document's saved 'txt' or 'json', as process_raw_html
+    names it"""
+    return re.sub('.html', '.' + output, html_filename)
+
+
+def json_value(value):
+    """JSON-compatible value for numpy's numbers, e.g. in statistics rows"""
+    return value.item()
+
+
+def timestamp():
+    return datetime.utcnow().strftime('%Y%m%d %H:%M:%S')
@@ -0,0 +1,69 @@
+from .utils import args, logger
+from .parse_text import transcript
+from .parse_watchdog import ParseTimeout, time_budget, timeout_diagnostics
+
+import threading
+import queue
+import time
+
+
+class ParsePipeline(object):
+    """Process downloaded documents on a separate pool of parse workers
+
+    Downloaders put() documents onto a bounded queue and return to the
+    network straight away; the parse workers take documents from the queue
+    and convert them. When the queue is full, put() blocks until a worker
+    catches up, so downloads can never run far ahead of parsing.
+    """
+    def __init__(self, workers=None, max_queued=None, parse_to_json=False):
+        self.parse_to_json = parse_to_json
+        self.queue = queue.Queue(maxsize=max_queued or args.parse_queue)
+        self.threads = []
+        for i in range(workers or args.parse_workers):
+            t = threading.Thread(target=self._worker, name='parser-%i' % i,
+                                 daemon=True)
+            t.start()
+            self.threads.append(t)
+
+    def put(self, html_text, source_document_locations, html_filename):
+        """Queue a HTML document for processing (blocks while queue is full)
+        """
+        self.queue.put((html_text, source_document_locations, html_filename))
+
+    def _worker(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    # shutdown signal
+                    break
+                html_text, source_document_locations, html_filename = item
+                current_transcript = transcript(html_text,
+                                                source_document_locations,
+                                                html_filename)
+                start = time.time()
+                # (in a thread, only the parser's regular expressions are
+                # held to the time budget)
+                with time_budget(args.parse_timeout):
+                    current_transcript.process_raw_html(
+                        parse=self.parse_to_json, outputs=['txt', 'json'])
+            except ParseTimeout as e:
+                from .parse_pool import get_quarantine
+                diagnostics = timeout_diagnostics(
+                    e, args.parse_timeout, time.time() - start,
+                    html_chars=len(item[0]))
+                logger.error('Quarantined %s: %s in %s' % (
+                    item[2], diagnostics['reason'], diagnostics['stage']))
+                get_quarantine().add(item[2], diagnostics)
+            except Exception as e:
+                logger.error('Failed to process %s: %s' % (item[2], e))
+            finally:
+                self.queue.task_done()
+
+    def close(self):
+        """Process every document still queued, then stop the workers"""
+        for _ in self.threads:
+            self.queue.put(None)
+        for t in self.threads:
+            t.join()
+        logger.info('Parse pipeline drained')
@@ -0,0 +1,158 @@
+from .utils import logger, args, configure_worker
+from .document_store import document_store
+from .corpus_tables import transcript_rows
+from .parse_watchdog import ParseTimeout, Quarantine, time_budget, \
+    timeout_diagnostics
+from . import parse_text
+
+from concurrent.futures import ProcessPoolExecutor
+import time
+import os
+
+
+_quarantine = None
+
+
+def get_quarantine():
+    """The documents which ran over their parse time budget"""
+    global _quarantine
+    if _quarantine is None:
+        _quarantine = Quarantine(os.path.join(args.storage,
+                                              'parse_quarantine.sqlite'))
+    return _quarantine
+
+
+def skip_quarantined(html_filenames):
+    """The documents to parse, leaving out those quarantined by an
+    earlier run unless --retry_quarantined
+
+    :param html_filenames: names of HTML documents in the store
+    :return: list of names
+    """
+    quarantined = get_quarantine().names()
+    if not quarantined or args.retry_quarantined:
+        return list(html_filenames)
+    logger.info('Skipping %i quarantined documents (see '
+                'parse_quarantine.sqlite, or use --retry_quarantined)' %
+                len(quarantined))
+    return [f for f in html_filenames if f not in quarantined]
+
+
+def init_worker(worker_args):
+    """Prepare a worker process: take the parent's options, and load the
+    spaCy model once, up front, rather than on the worker's first document
+
+    :param worker_args: dict of the parent's args
+    """
+    configure_worker(worker_args)
+    parse_text.get_ner_cache()
+
+
+def parse_document(html_filename, url_document=None, saved_outputs=None):
+    """Parse one stored HTML document, in memory, saving what --outputs
+    asks for
+
+    Runs in a worker process. A document which takes longer than
+    --parse_timeout seconds is abandoned and quarantined (see
+    parse_watchdog), so that one pathological document can't hold up a
+    worker.
+    :param html_filename: name of the HTML document in the store
+    :param url_document: where the document was downloaded from, if known
+    :param saved_outputs: if the document is unchanged since it was last
+        parsed, the outputs saved then (see ParseManifest.saved_outputs),
+        which are read back rather than parsing the document again
+    :return: (hyperlink, key data dict, witness statistics records (see
+        analyse_transcript.witness_records), corpus table rows), each of
+        the last three None unless --outputs includes 'summary', 'stats'
+        or 'tables'; or None on failure or timeout
+    """
+    html_text = None
+    trscrpt = None
+    start = time.time()
+    try:
+        with time_budget(args.parse_timeout):
+            html_text = document_store().get_text(html_filename)
+            source_document_locations = {
+                'status': 'read html from directory',
+                'html_file_location': html_filename}
+            if url_document:
+                source_document_locations['url_document'] = url_document
+            trscrpt = parse_text.transcript(
+                html_text, source_document_locations,
+                html_filename=html_filename)
+            if saved_outputs:
+                load_saved_outputs(trscrpt, saved_outputs)
+            else:
+                trscrpt.process_raw_html()
+            key_data, hyperlink = trscrpt.key_data_summary()
+            if 'summary' not in args.outputs:
+                key_data = None
+            stats_records = None
+            if 'stats' in args.outputs:
+                from .analyse_transcript import witness_records
+                stats_records = witness_records(trscrpt.transcript_data)
+            table_rows = transcript_rows(trscrpt.transcript_data) \
+                if 'tables' in args.outputs else None
+        if args.retry_quarantined:
+            get_quarantine().remove(html_filename)
+        return hyperlink, key_data, stats_records, table_rows
+    except ParseTimeout as e:
+        diagnostics = timeout_diagnostics(
+            e, args.parse_timeout, time.time() - start,
+            html_chars=len(html_text) if html_text is not None else None,
+            text_chars=len(getattr(trscrpt, 'plain_text', '')) or None)
+        logger.error('Quarantined %s: %s in %s after %.1fs' % (
+            html_filename, diagnostics['reason'], diagnostics['stage'],
+            diagnostics['elapsed_secs']))
+        get_quarantine().add(html_filename, diagnostics)
+        return None
+    except Exception as e:
+        logger.error('Failed to parse %s: %s' % (html_filename, e))
+        return None
+
+
+def load_saved_outputs(trscrpt, saved_outputs):
+    """Fill in a transcript from the JSON (and text, if it was saved) of
+    an earlier parse"""
+    store = document_store()
+    saved_txt = saved_outputs.get('txt')
+    if saved_txt and store.sha1(saved_txt['name']) == saved_txt['sha1']:
+        plain_text = store.get_text(saved_txt['name'])
+    elif 'summary' in args.outputs:
+        # only the summary needs the text
+        trscrpt.process_raw_html(parse=False, outputs=[])
+        plain_text = trscrpt.plain_text
+    else:
+        plain_text = ''
+    trscrpt.load_parsed(store.get_text(saved_outputs['json']['name']),
+                        plain_text)
+
+
+def parse_corpus(html_filenames, processes=None, chunksize=4,
+                 document_urls=None, saved_outputs=None):
+    """Parse documents on a pool of worker processes
+
+    :param html_filenames: names of HTML documents in the store
+    :param document_urls: dict of document names to the URLs they were
+        downloaded from
+    :param saved_outputs: dict of the names of documents which are
+        unchanged since they were last parsed to the outputs saved then
+    :param processes: number of worker processes (default: one per core)
+    :param chunksize: documents sent to a worker at a time
+    :return: generator of parse_document results in the order of
+        html_filenames, whichever order the workers finish in
+    """
+    with ProcessPoolExecutor(max_workers=processes,
+                             initializer=init_worker,
+                             initargs=(vars(args),)) as executor:
+        document_urls = document_urls or {}
+        saved_outputs = saved_outputs or {}
+        results = executor.map(parse_document, html_filenames,
+                               [document_urls.get(f) for f in html_filenames],
+                               [saved_outputs.get(f) for f in html_filenames],
+                               chunksize=chunksize)
+        for i, (html_filename, result) in enumerate(zip(html_filenames,
+                                                        results)):
+            logger.info('%i / %i: %s' % (i, len(html_filenames),
+                                         html_filename))
+            yield result
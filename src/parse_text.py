@@ -1,16 +1,64 @@
 import re
 import json
 import os
-from fuzzywuzzy import process
-import spacy
 
 from .utils import logger, args, html_to_txt
-
-
-# https://spacy.io/usage/models
-nlp = spacy.load('en_core_web_sm')
-# nlp = spacy.load('en_core_web_md')
-# nlp = spacy.load('en_core_web_lg')
+from .document_store import document_store
+from .ner_cache import NerCache
+from .person_registry import PersonRegistry
+from .speaker_matcher import SpeakerMatcher
+from .parse_watchdog import ParseTimeout, regex_search, regex_sub
+from .segment_text import LineIndex, split_at_header_lines, \
+    split_at_first_line, find_witness_line, find_first_qna_line, \
+    speaker_chunks
+
+
+# section headers, matched at the start of a line
+EXAMINATION_HEADER_RE = re.compile(r'\s*\**(?:examination of witness)',
+                                   re.IGNORECASE)
+QUESTIONS_HEADER_RE = re.compile(
+    r'\s*\**(?:questions \[?\d+|examination of witness)', re.IGNORECASE)
+CHAIR_START_RE = re.compile(r'\**(?:Q\s?\d+|Chair)')
+# the speaker's label at the start of a Q&A section, and the text spoken
+SPEAKER_LABEL_RE = re.compile(r'((?:Q\s?\d+\s?)?\_?\*\*.{,30}\*\*\_?)(.*)',
+                              re.DOTALL)
+LABEL_MARKUP = str.maketrans('', '', '_*:')
+QUESTION_NUMBER_RE = re.compile(r'(Q[\s.]?\d+)(.*)')
+WHITESPACE_RE = re.compile(r'\s+')
+
+_ner_cache = None
+_person_registry = None
+
+
+def get_ner_cache():
+    """The spaCy model, wrapped in its results cache
+
+    spaCy and the model take a while to load, so we only load them the
+    first time they're needed.
+    """
+    global _ner_cache
+    if _ner_cache is None:
+        import spacy
+        # https://spacy.io/usage/models
+        # people_from_text only reads the part-of-speech tags and named
+        # entities, so we don't load the dependency parser
+        nlp = spacy.load('en_core_web_sm', disable=['parser'])
+        # nlp = spacy.load('en_core_web_md')
+        # nlp = spacy.load('en_core_web_lg')
+        _ner_cache = NerCache(nlp,
+                              os.path.join(args.storage, 'ner_cache.sqlite')
+                              if args.ner_cache == 'disk' else None)
+    return _ner_cache
+
+
+def get_person_registry():
+    """The register of people named across the corpus"""
+    global _person_registry
+    if _person_registry is None:
+        _person_registry = PersonRegistry(
+            os.path.join(args.storage, 'person_registry.sqlite')
+            if args.person_registry == 'disk' else ':memory:')
+    return _person_registry
 
 
 class transcript(object):
@@ -23,24 +71,47 @@ class transcript(object):
         self.raw_html = transcript_text
         self.transcript_data = source_document_locations
         self.html_filename = html_filename
-        self.storage_path = args.storage
+        self.store = document_store()
+
 
+    def process_raw_html(self, parse = True, outputs = None):
+        """Convert HTML to plain text, and parse it into transcript_data
 
-    def process_raw_html(self, parse_to_json = True):
-        """Convert HTML to plain text. Option to parse data to JSON file"""
+        Everything is done in memory; the text and the parsed data are only
+        saved if asked for.
+        :param parse: parse the plain text into transcript_data
+        :param outputs: documents to save: 'txt' and/or 'json'
+            (default: --outputs)
+        """
+        outputs = args.outputs if outputs is None else outputs
         self.plain_text = html_to_txt(self.raw_html)
-        txt_filename = re.sub('.html', '.txt', self.html_filename)
-        with open(os.path.join(self.storage_path, txt_filename), 'w',
-                  encoding='utf-8') as txt_file:
-            txt_file.write(self.plain_text)
-        if parse_to_json:
+        if 'txt' in outputs:
+            txt_filename = re.sub('.html', '.txt', self.html_filename)
+            self.store.put(txt_filename, self.plain_text)
+        if parse:
             self.parse_plain_text()
+        if parse and 'json' in outputs:
             json_filename = re.sub('.html', '.json', self.html_filename)
             json_text = json.dumps(self.transcript_data,
                                    sort_keys=False, indent=4)
-            with open(os.path.join(self.storage_path, json_filename), 'w',
-                      encoding='utf-8') as json_file:
-                json_file.write(json_text)
+            self.store.put(json_filename, json_text)
+
+
+    def load_parsed(self, json_text, plain_text):
+        """Take the transcript_data saved by an earlier parse, instead of
+        parsing the HTML again
+
+        :param json_text: the JSON saved by process_raw_html
+        :param plain_text: the text saved by process_raw_html
+        """
+        self.transcript_data = json.loads(json_text)
+        self.plain_text = plain_text
+        # each speaker label's entry, as match_speakers_to_people made it
+        self.speakers_dict = {}
+        for s in self.transcript_data.get('all_sections', []):
+            if 'speaker' in s:
+                self.speakers_dict.setdefault(s['speaker_string'],
+                                              s['speaker'])
 
 
     def parse_plain_text(self):
@@ -105,6 +176,17 @@ class transcript(object):
         people_variants = {p: p for p in people_names}
         for p in people_names:
             people_variants[re.sub('(Rt|Hon|MP)', '', p).strip()] = p
+        matcher = SpeakerMatcher(people_variants)
+        # and look up the people by their canonical ids, so that labels
+        # naming someone we already know (by any of their names' short
+        # forms, e.g. just their surname) can be resolved without fuzzy
+        # matching
+        registry = get_person_registry()
+        people_by_canonical_id = {}
+        for p in people_names:
+            if people[p].get('canonical_id') is not None:
+                people_by_canonical_id.setdefault(
+                    people[p]['canonical_id'], p)
 
 
         # Iterate through speakers, ignoring blanks, and singleton
@@ -118,14 +200,27 @@ class transcript(object):
                 # attempting to match, this removes some potential confusion,
                 # leaving just the name itself as the basis of the match
                 ss = re.sub('(Mr|Mrs|Miss|Dr|Professor|Prof)', '', s).strip()
-                person_match = process.extractOne(
-                    ss, [p for p in people_variants], score_cutoff=10)
-                if person_match[1] < 95:
-                    logger.warn('low score %i name match: %s chosen for %s' %
-                                (person_match[1], person_match[0], s))
+                registry_names = set(
+                    people_by_canonical_id[i] for i in registry.person_ids(ss)
+                    if i in people_by_canonical_id)
+                if len(registry_names) == 1:
+                    # the label names exactly one of the transcript's
+                    # people, so there's no fuzzy match (or score)
+                    person_name = registry_names.pop()
+                    score = None
+                    matched_by = 'registry'
+                else:
+                    person_match = matcher.extract_one(ss, score_cutoff=10)
+                    if person_match[1] < 95:
+                        logger.warn('low score %i name match: %s chosen for %s' %
+                                    (person_match[1], person_match[0], s))
+                    person_name = people_variants[person_match[0]]
+                    score = person_match[1]
+                    matched_by = 'fuzzy'
                 speakers_dict[s] = {'label_count': 0,
-                                    'person': people[people_variants[person_match[0]]].copy(),
-                                    'fuzzy_match_score': person_match[1]}
+                                    'person': people[person_name].copy(),
+                                    'fuzzy_match_score': score,
+                                    'matched_by': matched_by}
             speakers_dict[s]['label_count'] += 1
         return speakers_dict
 
@@ -173,22 +268,23 @@ def parse_sections(plain_text):
     # the top of the document.
     # TODO: this assumes that all panels will be preceded by another 'examination of witnesses' heading - this might not be the case.
     # TODO ...consider using same approach as Step 2, but delete any blocks with too few characters.
-    panels_sections = re.split('(?:^\s*\**(?:examination of witness).*\n)+',
-                               plain_text,
-                               flags=re.IGNORECASE + re.MULTILINE)
+    # (all three attempts work from one pass over the document's lines,
+    # see segment_text)
+    lines = LineIndex(plain_text)
+    panels_sections = split_at_header_lines(
+        lines, [bool(EXAMINATION_HEADER_RE.match(line))
+                for line in lines.lines])
     # second attempt to split: split whenever we have a 'questions' or
     # 'examinations' header. works well, with flexibility,
     # with multiple panels
     if len(panels_sections) == 1 or len(panels_sections[0]) > 3000:
-        panels_sections = re.split(
-            '(?:^\s*\**(?:questions \[?\d+|examination of witness).*\n)+',
-            plain_text, flags=re.IGNORECASE + re.MULTILINE)
+        panels_sections = split_at_header_lines(
+            lines, [bool(QUESTIONS_HEADER_RE.match(line))
+                    for line in lines.lines])
     # third attempt: apparently there's no proper headers,
     # so we just split where the Chair introduces the meeting.
     if len(panels_sections) == 1 or len(panels_sections[0]) > 3000:
-        panels_sections = re.split(r'(?:^\s*\**(?:Q\s?\d+|Chair))',
-                                   plain_text,
-                                   flags=re.MULTILINE, maxsplit=1)
+        panels_sections = split_at_first_line(lines, CHAIR_START_RE)
         if len(panels_sections) > 1:
             # reinstate the 'Chair' word that we removed with re.split
             panels_sections[1] = r'**Chair' + panels_sections[1]
@@ -199,7 +295,9 @@ def parse_sections(plain_text):
     # (with a negative-lookahead check to make sure that the
     # witnesses list doesn't in fact appear after the 'Use' notes)
     # (example: see 78101.html)
-    header_text = re.sub(
+    # (the lookahead reads to the end of the text for every match, so this
+    # runs within the document's time budget, see parse_watchdog)
+    header_text = regex_sub(
         'use of the transcript(?!.*(\nwitness|gave evidence).*).*',
         '', header_text, flags=re.IGNORECASE + re.DOTALL)
     search_written_evidence = re.search('^Written evidence.*',
@@ -223,20 +321,25 @@ def parse_header(trscrpt, header_text):
     header_text = re.sub(r'[\_\*]', '', header_text)
 
     try:
-        members_search = re.search(r'(members present[:\s]*.*?\n)',
-                                   header_text.strip(),
-                                   re.IGNORECASE + re.DOTALL)
+        members_search = regex_search(r'(members present[:\s]*.*?\n)',
+                                      header_text.strip(),
+                                      re.IGNORECASE + re.DOTALL)
         if members_search is None:
             # Case where members list does not have a proper
             # 'Members present' label. So we just look for the first
             # sentence in the header which appears to include
             # a '(chair)' in its text, and take this as the Members listing
-            members_search = re.search(r'(.*\(chair.*\).*)',
-                                       header_text.strip(), re.IGNORECASE)
+            members_search = regex_search(r'(.*\(chair.*\).*)',
+                                          header_text.strip(), re.IGNORECASE)
         members_text = members_search.groups()[0].strip()
         trscrpt['members_text'] = members_text
-        other_text = re.sub(members_text, '', header_text)
+        # use str.replace: as a pattern, the members line's parentheses
+        # (e.g. '(Chair)') don't match themselves, and other characters can
+        # make an invalid pattern or one which backtracks for ever
+        other_text = header_text.replace(members_text, '')
         trscrpt['members'] = people_from_text(members_text, 'member')
+    except ParseTimeout:
+        raise
     except:
         logger.warning('FAILED TO PARSE MEMBERS FROM HEADER TEXT')
         other_text = ''
@@ -250,10 +353,11 @@ def parse_header(trscrpt, header_text):
         # witnesses names) (alternative approach would be to use findall or
         # finditer to process multiple lines each of which
         # begins with witnesss')
-        witnesses_search = re.search(r'(\nWitness.*)',
-                                     header_text.strip(), flags=re.DOTALL)
+        witnesses_search = regex_search(r'(\nWitness.*)',
+                                        header_text.strip(), flags=re.DOTALL)
         if not witnesses_search:
-            witnesses_search = re.search(r'(.*gave evidence)', header_text)
+            witnesses_search = regex_search(r'(.*gave evidence)',
+                                            header_text)
 
         witnesses_text = witnesses_search.groups()[0].strip()
         witnesses_text = re.sub('gave evidence', '', witnesses_text)
@@ -266,8 +370,8 @@ def parse_header(trscrpt, header_text):
         # header then a series of hyperlinks
         # strangely cannot use re.IGNORECASE here, it makes the
         # re.sub work inconsistently?!
-        witnesses_text = re.sub('.*(Written evidence|http).*',
-                                '', witnesses_text)
+        witnesses_text = regex_sub('.*(Written evidence|http).*',
+                                   '', witnesses_text)
         # remove witnesses_text from other_text.
         # use str.replace instead of re.sub which gets confused by
         # parentheses and square brackets in the text
@@ -277,6 +381,8 @@ def parse_header(trscrpt, header_text):
         trscrpt['header_other_text'] = other_text
 
         trscrpt['witnesses'] = people_from_text(witnesses_text, 'witness')
+    except ParseTimeout:
+        raise
     except:
         logger.warning('FAILED TO PARSE WITNESSES TEXT FROM HEADER TEXT')
         trscrpt['witnesses'] = {}
@@ -287,6 +393,10 @@ def parse_header(trscrpt, header_text):
     # create a unique index id for each person identified
     for i, s in enumerate(trscrpt['all_people']):
         trscrpt['all_people'][s]['id'] = i  # a unique index number for each speaker
+    # and the person's id across the whole corpus
+    registry = get_person_registry()
+    for p in trscrpt['all_people'].values():
+        p['canonical_id'] = registry.register(p['name'], p['speaker_type'])
     # d['all_people_names'] = [s['name'] for s in d['all_people']]
 
     return trscrpt
@@ -301,38 +411,26 @@ def parse_panel(panel_text):
     # all of the text that happens before the first question 'Q'.
     witness_line = None
     panel_qna_text = None
-    find_witnesses_1 = \
-        re.search(
-            r'(witness(?:es)?:.*\n|.*gave evidence\.{,4})([\s\S]*)',
-            panel_text, flags=re.IGNORECASE + re.MULTILINE)
-    # second group captures the whole Q&A text:
-    # \s\S means any chracter, including newline, this approach
-    # required so we can use re.MULTILINE. Works better than
-    # re.DOTALL here, because we have to use re.MULTILINE here.
-    find_witnesses_2 = \
-        re.search(
-            r'(.*\n)((?:\**Chair|\**Q\s?\d+)[\s\S]*)',
-            panel_text, flags=re.IGNORECASE + re.MULTILINE)
-    # first group captures the (unlabelled) witnesses line,
-    # second group captures the whole Q&A text, which is
-    # expected to either begin with the Chair's introduction,
-    # or the first Question
-    if find_witnesses_1 and \
-                    find_witnesses_1.span()[0] < 200:
-        # (Additional check for location of the pattern in the
-        # panel_text: Ignore 'witnesses' and 'gave evidence'
-        # as markers if they appear beyond the first couple of
-        # lines of text
-        witness_line = find_witnesses_1.groups()[0]
-        panel_qna_text = find_witnesses_1.groups()[1] + \
-                       '\n'
-    elif find_witnesses_2:
-        # there are no witness lines that begin with 'Witnesses'
-        # so we just assume the first line is the witnesses list
-        witness_line = 'Witnesses without a heading: ' + \
-                       find_witnesses_2.groups()[0]
-        panel_qna_text = find_witnesses_2.groups()[1] + \
+    lines = LineIndex(panel_text)
+    # Ignore 'witnesses' and 'gave evidence' as markers if they appear
+    # beyond the first couple of lines of text
+    find_witnesses_1 = find_witness_line(lines, max_start=200)
+    if find_witnesses_1:
+        witness_line = find_witnesses_1[1]
+        panel_qna_text = find_witnesses_1[2] + \
                        '\n'
+    else:
+        # the (unlabelled) witnesses line, and the whole Q&A text, which
+        # is expected to either begin with the Chair's introduction, or the
+        # first Question
+        find_witnesses_2 = find_first_qna_line(lines)
+        if find_witnesses_2:
+            # there are no witness lines that begin with 'Witnesses'
+            # so we just assume the first line is the witnesses list
+            witness_line = 'Witnesses without a heading: ' + \
+                           find_witnesses_2[0]
+            panel_qna_text = find_witnesses_2[1] + \
+                           '\n'
 
     return witness_line, panel_qna_text
 
@@ -349,14 +447,39 @@ def people_from_text(names_string, speaker_type):
     valid_pos_for_names = ['PROPN','PUNCT','ADP','DET','VERB']
     affiliation_and_designation_keywords = ['National','Foundation','Office']
     names_string = re.sub(';\s+', '; NEXTNAME ', names_string)
-    names_groups = re.split(r'(?:[\n:;,()]+|\sand\s)', names_string)
+    names_groups = [re.sub('\.$','',ng.strip()) for ng in
+                    re.split(r'(?:[\n:;,()]+|\sand\s)', names_string)]
+    fragments = list(dict.fromkeys(
+        ng.strip() for ng in names_groups
+        if not re.search('(witness|members)', ng, flags=re.IGNORECASE)))
+    # fragments which are the full name of someone in the person registry
+    # are names without asking spaCy
+    registry = get_person_registry()
+    known_names = {}
+    for f in fragments:
+        name = re.sub(r'\bNEXTNAME\b', '', f).strip()
+        if registry.person_id(name) is not None:
+            known_names[f] = name.split()
+    # run the other fragments through spaCy together, in batches, rather
+    # than paying the pipeline overhead for each short fragment (and most
+    # fragments come straight from the cache)
+    unknown_fragments = [f for f in fragments if f not in known_names]
+    fragment_docs = dict(zip(unknown_fragments,
+                             get_ner_cache().analyse(unknown_fragments))) \
+        if unknown_fragments else {}
     people = []
     name_extracted = []
     designation_extracted = []
     for ng in names_groups:
-        ng = re.sub('\.$','',ng.strip())
-        if not re.search('(witness|members)',ng, flags=re.IGNORECASE):
-            doc = nlp(ng.strip())
+        if not re.search('(witness|members)',ng, flags=re.IGNORECASE) and \
+                ng.strip() in known_names:
+            if len(name_extracted)>0:
+                append_person_name(name_extracted, designation_extracted,
+                                   speaker_type, people)
+            name_extracted = list(known_names[ng.strip()])
+            designation_extracted = []
+        elif not re.search('(witness|members)',ng, flags=re.IGNORECASE):
+            doc = fragment_docs[ng.strip()]
             # TODO: consider doing NLP on names word-by-word to avoid bad
             # results with 'David Davies' etc. 41400.html [doc #3]
             # Instead use SpaCy model core_web_md, seems to have better NER?
@@ -423,33 +546,30 @@ def people_from_text(names_string, speaker_type):
 
 def parse_qna_lines(qna_text):
     #
+    return list(qna_sections(qna_text))
 
-    qna_list = []
-    # wherever **bold** text appears (possibly _**bolditalic**_, this is
-    #   deemed to be a 'new speaker'.
-    # Here, any new line starting with **bold** text, or a (non-bold)
-    #   'Q' question number is labelled as representing a new speaker
-    qna_text = re.sub(r'\n(Q\s?\d+|\_?\*\*)', r'\nNEWSPEAKER\g<1>',
-                      qna_text.strip())
-    # break the text apart at the parts that we have
-    # identified as new speakers
-    qna_text_list = re.split('NEWSPEAKER', qna_text)
 
+def qna_sections(qna_text):
+    """Generate the Q&A sections of the text, one speaker's turn at a time
 
-    for i, unparsed_text in enumerate(qna_text_list):
+    Wherever **bold** text appears (possibly _**bolditalic**_), this is
+    deemed to be a 'new speaker'. Here, any new line starting with **bold**
+    text, or a (non-bold) 'Q' question number is labelled as representing a
+    new speaker.
+    """
+    for i, unparsed_text in enumerate(speaker_chunks(qna_text.strip())):
         # try to extract a speaker name (and potentially a question number)
         # from the start of the line
         # split the paragraph into the name (includes question number) and
         # the main text of the question:
-        name_and_text = re.search(r'((?:Q\s?\d+\s?)?\_?\*\*.{,30}\*\*\_?)(.*)',
-                                  unparsed_text, re.DOTALL)
+        name_and_text = SPEAKER_LABEL_RE.search(unparsed_text)
         if name_and_text:
             section_info = {'section_id': i,
                             'spoken_text': name_and_text.groups()[1].strip()}
             # name_text: the question number (if any) and speaker name
-            name_text = re.sub(r'[\_\*:]*', '', name_and_text.groups()[0])
+            name_text = name_and_text.groups()[0].translate(LABEL_MARKUP)
             # attempt to split name_text into question and speaker name
-            q_number_and_name = re.search(r'(Q[\s.]?\d+)(.*)', name_text)
+            q_number_and_name = QUESTION_NUMBER_RE.search(name_text)
             if q_number_and_name:
                 speaker_string = q_number_and_name.groups()[1].strip()
                 section_info['question_number'] = \
@@ -458,17 +578,16 @@ def parse_qna_lines(qna_text):
                 speaker_string = name_text.strip()
 
             # standarise labelling where the chair is speaking
-            speaker_string = re.sub('The Chairman','Chair', speaker_string)
+            speaker_string = speaker_string.replace('The Chairman', 'Chair')
             section_info['speaker_string'] = \
-                re.sub('\s+', ' ', speaker_string)
-            qna_list.append(section_info)
+                WHITESPACE_RE.sub(' ', speaker_string)
+            yield section_info
 
         else:
             # if no speaker name extracted,
             # then just take the line as 'unparsed text'
-            qna_list.append({'section_id': i,
-                             'unparsed_text': unparsed_text.strip()})
-    return qna_list
+            yield {'section_id': i,
+                   'unparsed_text': unparsed_text.strip()}
 
 
 def append_person_name(name_parts, designation_parts,
@@ -0,0 +1,176 @@
+from contextlib import contextmanager
+from datetime import datetime
+import traceback
+import threading
+import inspect
+import sqlite3
+import signal
+import json
+import time
+import os
+import re
+
+try:
+    # the regex module can stop a match which runs on too long, which re
+    # can't; without it, regular expressions run without a time limit
+    import regex
+except ImportError:
+    regex = None
+
+# releases of regex before 2019 have no timeout, and quietly take it as a
+# named list instead, so look for it rather than trusting the keyword
+REGEX_TIMEOUT = regex is not None and \
+    'timeout' in inspect.signature(regex.search).parameters
+
+
+class ParseTimeout(Exception):
+    """A document ran over its parse time budget"""
+    pass
+
+
+_budget = threading.local()
+
+
+@contextmanager
+def time_budget(seconds):
+    """Limit the time taken by the code in the with block
+
+    Raises ParseTimeout in the block once the time is up. In the main
+    thread of a process, an alarm signal interrupts the Python code
+    wherever it is; in other threads, only the regular expressions run
+    through regex_search and regex_sub are limited. A regular expression
+    in the middle of a match can't be interrupted by the alarm, so those
+    are given the time remaining as their timeout (if a regex module with
+    timeouts is installed, see REGEX_TIMEOUT).
+    :param seconds: time allowed, or 0/None for no limit
+    """
+    if not seconds:
+        yield
+        return
+    _budget.deadline = time.time() + seconds
+    use_alarm = hasattr(signal, 'setitimer') and \
+        threading.current_thread() is threading.main_thread()
+    if use_alarm:
+        previous_handler = signal.signal(signal.SIGALRM, _on_alarm)
+        signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous_handler)
+        _budget.deadline = None
+
+
+def _on_alarm(signum, frame):
+    raise ParseTimeout('ran over the time budget')
+
+
+def remaining_time():
+    """Seconds left in the current time_budget, or None if there's none"""
+    deadline = getattr(_budget, 'deadline', None)
+    return None if deadline is None else deadline - time.time()
+
+
+def regex_search(pattern, string, flags=0):
+    """re.search, stopped with ParseTimeout at the end of the time budget"""
+    return _run_regex('search', pattern, (string,), flags)
+
+
+def regex_sub(pattern, repl, string, flags=0):
+    """re.sub, stopped with ParseTimeout at the end of the time budget"""
+    return _run_regex('sub', pattern, (repl, string), flags)
+
+
+def _run_regex(function_name, pattern, arguments, flags):
+    remaining = remaining_time()
+    if not REGEX_TIMEOUT or remaining is None:
+        return getattr(re, function_name)(pattern, *arguments, flags=flags)
+    if remaining <= 0:
+        raise ParseTimeout('ran over the time budget before %r' % pattern)
+    try:
+        return getattr(regex, function_name)(pattern, *arguments,
+                                             flags=flags, timeout=remaining)
+    except TimeoutError:
+        raise ParseTimeout('ran over the time budget in %r' % pattern)
+
+
+def timeout_diagnostics(exception, budget, elapsed, **details):
+    """What we know about a ParseTimeout, for the quarantine list
+
+    :param exception: the ParseTimeout
+    :param details: anything else to record, e.g. the document's size
+    :return: dict
+    """
+    # the innermost parsing function we were in when time ran out
+    stage = None
+    for frame in traceback.extract_tb(exception.__traceback__):
+        if os.path.basename(frame.filename) in ('parse_text.py',
+                                                'segment_text.py',
+                                                'html_convert.py',
+                                                'utils.py'):
+            stage = frame.name
+    diagnostics = {'reason': str(exception), 'stage': stage,
+                   'budget_secs': budget, 'elapsed_secs': round(elapsed, 2)}
+    diagnostics.update(details)
+    return diagnostics
+
+
+class Quarantine(object):
+    """Documents set aside after running over their parse time budget
+
+    Each entry records why and where the parse stopped, so the document
+    can be looked at separately without holding up the rest of the batch.
+    Stored in SQLite, so that parse worker processes can add to it.
+    """
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self._connection = None
+        self._connection_pid = None
+
+    @property
+    def connection(self):
+        # one connection per process: SQLite connections must not be
+        # carried across a fork
+        if self._connection_pid != os.getpid():
+            self._connection = sqlite3.connect(self.db_path, timeout=60,
+                                               check_same_thread=False)
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS quarantine ('
+                'name TEXT PRIMARY KEY, quarantined_at TEXT, '
+                'diagnostics TEXT)')
+            self._connection_pid = os.getpid()
+        return self._connection
+
+    def add(self, name, diagnostics):
+        """Quarantine a document
+
+        :param name: document name, e.g. '12345.html'
+        :param diagnostics: dict, e.g. from timeout_diagnostics
+        """
+        with self.lock:
+            with self.connection:
+                self.connection.execute(
+                    'INSERT OR REPLACE INTO quarantine VALUES (?, ?, ?)',
+                    (name, datetime.utcnow().strftime('%Y%m%d %H:%M:%S'),
+                     json.dumps(diagnostics)))
+
+    def remove(self, name):
+        with self.lock:
+            with self.connection:
+                self.connection.execute(
+                    'DELETE FROM quarantine WHERE name = ?', (name,))
+
+    def names(self):
+        with self.lock:
+            return set(name for (name,) in self.connection.execute(
+                'SELECT name FROM quarantine'))
+
+    def entries(self):
+        """dict of each quarantined document's name to its diagnostics"""
+        with self.lock:
+            return {name: dict(json.loads(diagnostics),
+                               quarantined_at=quarantined_at)
+                    for name, quarantined_at, diagnostics in
+                    self.connection.execute('SELECT * FROM quarantine')}
@@ -0,0 +1,186 @@
+import threading
+import sqlite3
+import uuid
+import os
+import re
+
+
+# words dropped from names before looking them up, so that e.g.
+# 'Rt Hon John Smith MP' and 'Mr John Smith' are the same person. Peerage
+# titles are kept: 'Lord Smith' is not 'Mr Smith'
+HONORIFICS_RE = r'\b(Rt|Hon|MP|Mr|Mrs|Ms|Miss|Dr|Professor|Prof|Sir|Dame)\b\.?'
+# titles which, with the word after them, are a peer's short name, e.g.
+# 'Lord Levene' for 'Lord Levene of Portsoken'
+PEERAGE_TITLES = ['lord', 'lady', 'baroness', 'baron', 'viscount',
+                  'viscountess', 'earl', 'countess', 'marquess', 'duke',
+                  'duchess', 'bishop']
+
+
+class PersonRegistry(object):
+    """Corpus-wide register of the people named in transcripts
+
+    Every person gets a canonical id, shared by all the variants of their
+    name (with or without honorifics, punctuation, etc.), so the same
+    member or witness can be followed across transcripts. The short forms
+    of each name (see short_forms) are kept too, since those are what Q&A
+    speaker labels and later headers mostly use; a short form may be
+    shared by several people, so it only identifies someone among a
+    transcript's own people, or when no one else has it. Each registry
+    database has its own generation id, made when it's created, since
+    canonical ids from one database mean nothing in another.
+
+    Stored in SQLite, and safe to share between threads and worker
+    processes.
+    """
+    def __init__(self, db_path=':memory:'):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self._connection = None
+        self._connection_pid = None
+
+    @property
+    def connection(self):
+        # one connection per process: SQLite connections must not be
+        # carried across a fork
+        if self._connection_pid != os.getpid():
+            # autocommit mode, so we can take the write lock up front with
+            # BEGIN IMMEDIATE when registering people
+            self._connection = sqlite3.connect(self.db_path, timeout=60,
+                                               check_same_thread=False,
+                                               isolation_level=None)
+            had_short_forms = self._connection.execute(
+                'SELECT 1 FROM sqlite_master WHERE name = ?',
+                ('short_forms',)).fetchone()
+            self._connection.executescript(
+                'CREATE TABLE IF NOT EXISTS people ('
+                'id INTEGER PRIMARY KEY, name TEXT, speaker_type TEXT);'
+                'CREATE TABLE IF NOT EXISTS variants ('
+                'variant TEXT PRIMARY KEY, person_id INTEGER);'
+                'CREATE INDEX IF NOT EXISTS variants_person_id '
+                'ON variants (person_id);'
+                'CREATE TABLE IF NOT EXISTS short_forms ('
+                'short_form TEXT, person_id INTEGER, '
+                'PRIMARY KEY (short_form, person_id));'
+                'CREATE TABLE IF NOT EXISTS meta ('
+                'key TEXT PRIMARY KEY, value TEXT);')
+            if not had_short_forms:
+                # a registry from before short forms were kept
+                self._connection.executemany(
+                    'INSERT OR IGNORE INTO short_forms VALUES (?, ?)',
+                    [(short_form, person_id) for variant, person_id in
+                     self._connection.execute(
+                         'SELECT variant, person_id FROM variants').fetchall()
+                     for short_form in short_forms(variant)])
+            # the first process to open a new database gives it its
+            # generation
+            self._connection.execute(
+                'INSERT OR IGNORE INTO meta VALUES (?, ?)',
+                ('generation', uuid.uuid4().hex[:12]))
+            self._connection_pid = os.getpid()
+        return self._connection
+
+    def generation(self):
+        """Id of this registry database, new each time it's created"""
+        with self.lock:
+            return self.connection.execute(
+                'SELECT value FROM meta WHERE key = ?',
+                ('generation',)).fetchone()[0]
+
+    def person_id(self, name):
+        """Canonical id of a person, or None if we haven't seen the name"""
+        key = name_key(name)
+        if not key:
+            return None
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT person_id FROM variants WHERE variant = ?',
+                (key,)).fetchone()
+        return row[0] if row else None
+
+    def person_ids(self, name):
+        """Canonical ids of everyone a name or short form could be
+
+        :return: set of ids (empty if we haven't seen the name)
+        """
+        key = name_key(name)
+        if not key:
+            return set()
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT person_id FROM variants WHERE variant = ? UNION '
+                'SELECT person_id FROM short_forms WHERE short_form = ?',
+                (key, key)).fetchall()
+        return set(row[0] for row in rows)
+
+    def register(self, name, speaker_type):
+        """Canonical id of a person, adding them if they're new
+
+        :param name: name as extracted from a transcript header
+        :param speaker_type: 'member' or 'witness', when first seen
+        :return: canonical id, or None for an empty name
+
+        A name that is only a short form, e.g. 'Mr Smith', is taken to be
+        the person it's the short form of, if there's exactly one.
+        """
+        key = name_key(name)
+        if not key:
+            return None
+        person_id = self.person_id(name)
+        if person_id is not None:
+            return person_id
+        with self.lock:
+            connection = self.connection
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                # another process may have added them since we looked
+                row = connection.execute(
+                    'SELECT person_id FROM variants WHERE variant = ?',
+                    (key,)).fetchone()
+                short_form_ids = connection.execute(
+                    'SELECT person_id FROM short_forms WHERE short_form = ?',
+                    (key,)).fetchall()
+                if row:
+                    person_id = row[0]
+                elif len(short_form_ids) == 1:
+                    person_id = short_form_ids[0][0]
+                else:
+                    person_id = connection.execute(
+                        'INSERT INTO people (name, speaker_type) '
+                        'VALUES (?, ?)', (name, speaker_type)).lastrowid
+                    connection.execute('INSERT INTO variants VALUES (?, ?)',
+                                       (key, person_id))
+                    connection.executemany(
+                        'INSERT OR IGNORE INTO short_forms VALUES (?, ?)',
+                        [(short_form, person_id)
+                         for short_form in short_forms(key)])
+                connection.execute('COMMIT')
+            except:
+                connection.execute('ROLLBACK')
+                raise
+        return person_id
+
+
+def name_key(name):
+    """Lookup key shared by variants of a person's name"""
+    key = re.sub(HONORIFICS_RE, '', name)
+    key = re.sub(r'[^\w\s-]', '', key)
+    return re.sub(r'\s+', ' ', key).strip().lower()
+
+
+def short_forms(key):
+    """Shorter ways of referring to a person, from their name_key
+
+    e.g. 'smith', 'john smith' and 'j smith' for 'john david smith', or
+    'lord levene' for 'lord levene of portsoken'
+    :return: list of keys, not including the name_key itself
+    """
+    words = key.split()
+    if len(words) < 2:
+        return []
+    if words[0] in PEERAGE_TITLES:
+        forms = set([' '.join(words[:2])])
+    else:
+        forms = set([words[-1], words[0] + ' ' + words[-1],
+                     words[0][0] + ' ' + words[-1]])
+    forms.discard(key)
+    return sorted(forms)
@@ -0,0 +1,264 @@
+from textstat.textstat import easy_word_set, legacy_round
+import numpy as np
+import operator
+import string
+import math
+import re
+
+
+# textstat's punctuation, removed from words before counting them
+PUNCTUATION = str.maketrans('', '', string.punctuation)
+SENTENCE_END_RE = re.compile(r' *[\.\?!][\'"\)\]]* *')
+
+
+class Readability(object):
+    """textstat's readability measures, from a single pass over each text
+
+    Each of textstat's functions tokenizes the text again, and hyphenates
+    every word again with Pyphen to count its syllables. Here each text is
+    split into words once, every measure is worked out from the one set of
+    counts, and the syllables of each word are remembered across texts,
+    since the same words come up again and again throughout the corpus.
+    The results are the same as textstat 0.4.1's, quirks and all (e.g.
+    syllables are counted in the words between single spaces, so that
+    words either side of a line break count as one).
+    """
+    def __init__(self, lang='en_US', max_cached_words=200000):
+        from pyphen import Pyphen
+        self.dic = Pyphen(lang=lang)
+        self.max_cached_words = max_cached_words
+        self.word_syllables = {}
+
+    def syllables(self, word):
+        """Syllables in a lower case word without punctuation, as
+        textstat.syllable_count (but 1 for an empty word)"""
+        count = self.word_syllables.get(word)
+        if count is None:
+            if len(self.word_syllables) >= self.max_cached_words:
+                self.word_syllables.clear()
+            count = max(1, self.dic.inserted(word).count('-') + 1)
+            self.word_syllables[word] = count
+        return count
+
+    def counts(self, text):
+        """Everything textstat counts in a text
+
+        :return: dict of the counts
+        """
+        clean_text = text.lower().translate(PUNCTUATION)
+        syllable_count = 0
+        lexicon_count = 0
+        if clean_text:
+            for token in clean_text.split(' '):
+                syllable_count += self.syllables(token)
+                lexicon_count += len(token.split())
+
+        # each word as it is in the text, with its syllables (0 for only
+        # punctuation)
+        words = text.split()
+        word_syllables = []
+        for word in words:
+            clean_word = word.lower().translate(PUNCTUATION)
+            word_syllables.append(self.syllables(clean_word) if clean_word
+                                  else 0)
+        difficult_words = set(
+            word for word, syllables in zip(words, word_syllables)
+            if syllables > 1 and word not in easy_word_set)
+
+        # linsear_write_formula only looks at the first hundred-odd words
+        linsear_syllables = word_syllables[:102]
+        return {
+            'syllable_count': syllable_count,
+            'lexicon_count': lexicon_count,
+            'sentence_count': sentence_count(text),
+            'char_count': len(text.replace(' ', '')),
+            'difficult_words': len(difficult_words),
+            'polysyllable_count': sum(1 for syllables in word_syllables
+                                      if syllables >= 3),
+            'linsear_easy_words': sum(1 for syllables in linsear_syllables
+                                      if syllables < 3),
+            'linsear_difficult_words': sum(1 for syllables in
+                                           linsear_syllables
+                                           if syllables > 3),
+            'linsear_sentence_count': sentence_count(' '.join(words[:100]))
+            if words else None}
+
+
+def sentence_count(text):
+    """textstat.sentence_count: sentences of more than two words"""
+    sentences = SENTENCE_END_RE.split(text)
+    short_sentences = sum(
+        1 for sentence in sentences
+        if len(sentence.translate(PUNCTUATION).split()) <= 2)
+    return max(1, len(sentences) - short_sentences)
+
+
+# textstat's measures, from the counts of Readability.counts, in the same
+# order of arithmetic as textstat so that the results are the same to the
+# last digit (and None where textstat would divide by zero)
+
+def avg_sentence_length(c):
+    return legacy_round(c['lexicon_count'] / c['sentence_count'], 1)
+
+
+def avg_syllables_per_word(c):
+    if not c['lexicon_count']:
+        return None
+    return legacy_round(float(c['syllable_count']) /
+                        float(c['lexicon_count']), 1)
+
+
+def avg_letter_per_word(c):
+    return legacy_round(float(float(c['char_count']) /
+                              float(c['lexicon_count'])), 2)
+
+
+def avg_sentence_per_word(c):
+    return legacy_round(float(float(c['sentence_count']) /
+                              float(c['lexicon_count'])), 2)
+
+
+def flesch_reading_ease(c):
+    fre = 206.835 - float(1.015 * avg_sentence_length(c)) - \
+        float(84.6 * avg_syllables_per_word(c))
+    return legacy_round(fre, 2)
+
+
+def flesch_kincaid_grade(c):
+    fkra = float(0.39 * avg_sentence_length(c)) + \
+        float(11.8 * avg_syllables_per_word(c)) - 15.59
+    return legacy_round(fkra, 1)
+
+
+def smog_index(c):
+    if c['sentence_count'] < 3:
+        return 0
+    smog = (1.043 * (30 * (c['polysyllable_count'] /
+                           c['sentence_count'])) ** .5) + 3.1291
+    return legacy_round(smog, 1)
+
+
+def coleman_liau_index(c):
+    letters = legacy_round(avg_letter_per_word(c) * 100, 2)
+    sentences = legacy_round(avg_sentence_per_word(c) * 100, 2)
+    cli = float((0.058 * letters) - (0.296 * sentences) - 15.8)
+    return legacy_round(cli, 2)
+
+
+def automated_readability_index(c):
+    a = float(c['char_count']) / float(c['lexicon_count'])
+    b = float(c['lexicon_count']) / float(c['sentence_count'])
+    ari = (4.71 * legacy_round(a, 2)) + (0.5 * legacy_round(b, 2)) - 21.43
+    return legacy_round(ari, 1)
+
+
+def linsear_write_formula(c):
+    if c['linsear_sentence_count'] is None:
+        return 0.0
+    number = float((c['linsear_easy_words'] * 1 +
+                    c['linsear_difficult_words'] * 3) /
+                   c['linsear_sentence_count'])
+    if number > 20:
+        number /= 2
+    else:
+        number = (number - 2) / 2
+    return float(number)
+
+
+def dale_chall_readability_score(c):
+    count = c['lexicon_count'] - c['difficult_words']
+    per = float(count) / float(c['lexicon_count']) * 100
+    difficult_words = 100 - per
+    if difficult_words > 5:
+        score = (0.1579 * difficult_words) + \
+            (0.0496 * avg_sentence_length(c)) + 3.6365
+    else:
+        score = (0.1579 * difficult_words) + \
+            (0.0496 * avg_sentence_length(c))
+    return legacy_round(score, 2)
+
+
+def gunning_fog(c):
+    if not c['lexicon_count']:
+        return None
+    per_diff_words = (c['difficult_words'] / c['lexicon_count'] * 100) + 5
+    return 0.4 * (avg_sentence_length(c) + per_diff_words)
+
+
+def text_standard(c):
+    """textstat.text_standard: the grade most of the measures agree on"""
+    if not c['lexicon_count']:
+        return None
+    grade = []
+    fk_grade = flesch_kincaid_grade(c)
+    grade.append(int(legacy_round(fk_grade)))
+    grade.append(int(math.ceil(fk_grade)))
+
+    score = flesch_reading_ease(c)
+    if 90 <= score < 100:
+        grade.append(5)
+    elif 80 <= score < 90:
+        grade.append(6)
+    elif 70 <= score < 80:
+        grade.append(7)
+    elif 60 <= score < 70:
+        grade.append(8)
+        grade.append(9)
+    elif 50 <= score < 60:
+        grade.append(10)
+    elif 40 <= score < 50:
+        grade.append(11)
+    elif 30 <= score < 40:
+        grade.append(12)
+    else:
+        grade.append(13)
+
+    for measure in [smog_index, coleman_liau_index,
+                    automated_readability_index, dale_chall_readability_score,
+                    linsear_write_formula, gunning_fog]:
+        value = measure(c)
+        grade.append(int(legacy_round(value)))
+        grade.append(int(math.ceil(value)))
+
+    # the most common grade (the last to appear, of equally common grades)
+    counts = dict([(x, grade.count(x)) for x in grade])
+    score = sorted(counts.items(), key=operator.itemgetter(1))[-1][0]
+    return str(int(score) - 1) + 'th ' + 'and ' + str(int(score)) + \
+        'th grade'
+
+
+# the same measures for whole columns of counts at once, e.g. for every
+# witness in the corpus (NaN where the scalar versions give None, or
+# where the counts are missing)
+
+def legacy_round_array(numbers, points=0):
+    """textstat's legacy_round, for a numpy array"""
+    p = 10 ** points
+    return np.floor((numbers * p) + np.copysign(0.5, numbers)) / p
+
+
+def syllables_per_word_column(syllable_counts, lexicon_counts):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(lexicon_counts > 0,
+                        legacy_round_array(syllable_counts / lexicon_counts,
+                                           1),
+                        np.nan)
+
+
+def gunning_fog_column(lexicon_counts, sentence_counts, difficult_words):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        avg_sentence_lengths = legacy_round_array(
+            lexicon_counts / sentence_counts, 1)
+        per_diff_words = (difficult_words / lexicon_counts * 100) + 5
+        return np.where(lexicon_counts > 0,
+                        0.4 * (avg_sentence_lengths + per_diff_words),
+                        np.nan)
+
+
+def smog_index_column(sentence_counts, polysyllable_counts):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        smog = legacy_round_array(
+            (1.043 * (30 * (polysyllable_counts / sentence_counts)) ** .5) +
+            3.1291, 1)
+        return np.where(sentence_counts >= 3, smog,
+                        np.where(np.isnan(sentence_counts), np.nan, 0.0))
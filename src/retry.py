@@ -0,0 +1,288 @@
+from .utils import args, logger
+
+from datetime import datetime
+from urllib.parse import urlparse
+from time import sleep, time
+import collections
+import threading
+import asyncio
+import random
+import json
+import os
+
+
+class RetriesExhausted(Exception):
+    """A request failed on every retry, and its URL was dead-lettered"""
+    pass
+
+
+class RetryPolicy(object):
+    """Exponential backoff with jitter: the n-th retry waits around
+    base_delay * 2**n seconds, capped at max_delay"""
+    def __init__(self, max_retries=10, base_delay=5, max_delay=600):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt):
+        delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+        # 'equal jitter': keep half the delay, randomise the other half, so
+        # workers which failed together don't all retry together
+        return delay / 2 + random.uniform(0, delay / 2)
+
+
+class CircuitBreaker(object):
+    """Stop sending requests to a host after repeated failures
+
+    After `threshold` consecutive failures the circuit opens, and requests
+    wait for `cooldown` seconds before trying the host again.
+    """
+    def __init__(self, host, threshold=5, cooldown=60):
+        self.host = host
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.lock = threading.Lock()
+        self.consecutive_failures = 0
+        self.open_until = 0
+
+    def wait_until_closed(self):
+        with self.lock:
+            wait_time = self.open_until - time()
+        if wait_time > 0:
+            sleep(wait_time)
+
+    def record_success(self):
+        with self.lock:
+            self.consecutive_failures = 0
+
+    def record_failure(self):
+        """:return: True if this failure opened the circuit"""
+        with self.lock:
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= self.threshold and \
+                    self.open_until < time():
+                self.open_until = time() + self.cooldown
+                logger.warning('Circuit open for %s: pausing %i secs after '
+                               '%i failures' % (self.host, self.cooldown,
+                                                self.consecutive_failures))
+                return True
+            return False
+
+
+class AdaptiveLimit(object):
+    """Limit on simultaneous requests, which halves when a host starts
+    failing and recovers by one slot after every run of successes"""
+    def __init__(self, max_limit, recover_after=20):
+        self.max_limit = max_limit
+        self.limit = max_limit
+        self.recover_after = recover_after
+        self.active = 0
+        self.successes = 0
+        self.condition = threading.Condition()
+
+    def __enter__(self):
+        with self.condition:
+            while self.active >= self.limit:
+                self.condition.wait()
+            self.active += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        with self.condition:
+            self.active -= 1
+            self.condition.notify()
+
+    def slow_down(self):
+        with self.condition:
+            self.limit = max(1, self.limit // 2)
+            self.successes = 0
+            logger.warning('Reduced concurrency to %i' % self.limit)
+
+    def record_success(self):
+        with self.condition:
+            self.successes += 1
+            if self.successes >= self.recover_after and \
+                    self.limit < self.max_limit:
+                self.limit += 1
+                self.successes = 0
+                self.condition.notify()
+
+
+class AsyncAdaptiveLimit(AdaptiveLimit):
+    """AdaptiveLimit for coroutines: `async with` waits for a slot without
+    blocking the event loop
+
+    Only to be used from the thread running the event loop.
+    """
+    def __init__(self, max_limit, recover_after=20):
+        super().__init__(max_limit, recover_after)
+        self.waiters = collections.deque()
+
+    async def __aenter__(self):
+        while self.active >= self.limit:
+            waiter = asyncio.get_event_loop().create_future()
+            self.waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                # don't swallow a wake-up meant for someone else
+                if waiter.done() and not waiter.cancelled():
+                    self._wake()
+                raise
+        self.active += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.active -= 1
+        self._wake()
+
+    def record_success(self):
+        super().record_success()
+        # the limit may have gone up
+        self._wake()
+
+    def _wake(self):
+        # wake as many waiters as there are free slots (each checks again
+        # when it runs, in case the limit has come down since)
+        free_slots = self.limit - self.active
+        while free_slots > 0 and self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free_slots -= 1
+
+
+class RetryScheduler(object):
+    """Shared retry, backoff and circuit breaking for all crawl requests
+
+    URLs which fail on every retry are written to a dead-letter file in
+    the storage folder, and the crawl carries on without them.
+    """
+    def __init__(self, storage_path, max_concurrency, policy=None,
+                 filename='dead_letters.json'):
+        self.policy = policy or RetryPolicy(args.max_retries,
+                                            args.retry_base_delay)
+        self.limit = AdaptiveLimit(max_concurrency)
+        self.breakers = {}
+        self.lock = threading.RLock()
+        self.dead_letters_path = os.path.join(storage_path, filename)
+        self.dead_letters = {}
+        if os.path.exists(self.dead_letters_path):
+            with open(self.dead_letters_path, 'r', encoding='utf-8') as f:
+                self.dead_letters = json.load(f)
+
+    def breaker(self, url):
+        host = urlparse(url).netloc
+        with self.lock:
+            if host not in self.breakers:
+                self.breakers[host] = CircuitBreaker(
+                    host, args.breaker_threshold, args.breaker_cooldown)
+            return self.breakers[host]
+
+    def call(self, url, request_function, retry_on, max_retries=None,
+             dead_letter=True):
+        """Make a request, retrying with backoff on failure
+
+        :param url: URL being requested (for circuit breaking and logging)
+        :param request_function: function without arguments making the request
+        :param retry_on: tuple of exception types which trigger a retry
+        :param max_retries: override the policy's number of retries
+        :param dead_letter: record the URL if every retry fails
+        :return: the result of request_function
+        :raises RetriesExhausted: if every retry failed
+        """
+        if max_retries is None:
+            max_retries = self.policy.max_retries
+        breaker = self.breaker(url)
+        for attempt in range(max_retries + 1):
+            breaker.wait_until_closed()
+            try:
+                with self.limit:
+                    result = request_function()
+                breaker.record_success()
+                self.limit.record_success()
+                if url in self.dead_letters:
+                    self.remove_dead_letter(url)
+                return result
+            except retry_on as e:
+                error = e
+                if breaker.record_failure():
+                    self.limit.slow_down()
+                if attempt < max_retries:
+                    wait_time = self.policy.delay(attempt)
+                    logger.warning(e)
+                    logger.info('URL: %s' % url)
+                    logger.info('Waiting %.0f secs and re-trying...' %
+                                wait_time)
+                    sleep(wait_time)
+        logger.error('Download repeatedly failed: %s', url)
+        if dead_letter:
+            self.add_dead_letter(url, error, max_retries + 1)
+        raise RetriesExhausted(url)
+
+    async def call_async(self, url, request_coroutine, retry_on, limit,
+                         wait_for_turn=None, max_retries=None,
+                         dead_letter=True):
+        """Coroutine version of call(), for the asyncio fetcher
+
+        Waits without blocking the event loop.
+        :param request_coroutine: function without arguments returning
+            a coroutine which makes the request
+        :param limit: AsyncAdaptiveLimit on the requests in flight, which
+            slows down and recovers as the limit of call() does
+        :param wait_for_turn: function without arguments returning a
+            coroutine to wait on before each attempt, e.g. for the host's
+            rate limit, without holding a place in the limit
+        """
+        if max_retries is None:
+            max_retries = self.policy.max_retries
+        breaker = self.breaker(url)
+        for attempt in range(max_retries + 1):
+            circuit_wait = breaker.open_until - time()
+            if circuit_wait > 0:
+                await asyncio.sleep(circuit_wait)
+            try:
+                if wait_for_turn:
+                    await wait_for_turn()
+                async with limit:
+                    result = await request_coroutine()
+                breaker.record_success()
+                limit.record_success()
+                if url in self.dead_letters:
+                    self.remove_dead_letter(url)
+                return result
+            except retry_on as e:
+                error = e
+                if breaker.record_failure():
+                    limit.slow_down()
+                if attempt < max_retries:
+                    wait_time = self.policy.delay(attempt)
+                    logger.warning('%s: %s' % (type(e).__name__, e))
+                    logger.info('URL: %s' % url)
+                    logger.info('Waiting %.0f secs and re-trying...' %
+                                wait_time)
+                    await asyncio.sleep(wait_time)
+        logger.error('Download repeatedly failed: %s', url)
+        if dead_letter:
+            self.add_dead_letter(url, error, max_retries + 1)
+        raise RetriesExhausted(url)
+
+    def add_dead_letter(self, url, error, attempts):
+        with self.lock:
+            self.dead_letters[url] = {
+                'error': str(error),
+                'attempts': attempts,
+                'failed_at': datetime.utcnow().strftime('%Y%m%d %H:%M:%S')}
+            self.save()
+
+    def remove_dead_letter(self, url):
+        with self.lock:
+            self.dead_letters.pop(url, None)
+            self.save()
+
+    def save(self):
+        with self.lock:
+            tmp_path = self.dead_letters_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.dead_letters, f, indent=4)
+            os.replace(tmp_path, self.dead_letters_path)
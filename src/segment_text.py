@@ -0,0 +1,177 @@
+import re
+
+
+# a new speaker's turn starts on a line beginning with a question number or
+# with **bold** (possibly _**bold italic**_) text
+NEW_SPEAKER_RE = re.compile(r'Q\s?\d+|\_?\*\*')
+WITNESSES_LABEL_RE = re.compile(r'witness(?:es)?:', re.IGNORECASE)
+GAVE_EVIDENCE_RE = re.compile(r'gave evidence', re.IGNORECASE)
+QNA_START_RE = re.compile(r'\**Chair|\**Q\s?\d+', re.IGNORECASE)
+
+
+class LineIndex(object):
+    """The lines of a text, split at '\\n' only, with their offsets and
+    whether each is blank (empty or only whitespace)"""
+    def __init__(self, text):
+        self.text = text
+        self.lines = text.split('\n')
+        self.starts = []
+        offset = 0
+        for line in self.lines:
+            self.starts.append(offset)
+            offset += len(line) + 1
+        self.blank = [not line or line.isspace() for line in self.lines]
+
+    def __len__(self):
+        return len(self.lines)
+
+
+def split_at_header_lines(index, headers):
+    """Split a text at runs of header lines
+
+    Gives the same pieces as re.split('(?:^\\s*\\**(?:HEADER).*\\n)+', text,
+    flags=re.MULTILINE), in one pass over the lines: each run of header
+    lines is removed, along with any blank lines before or between them.
+    :param index: LineIndex of the text
+    :param headers: for each line, whether it is a header line, i.e.
+        re.match('\\s*\\**(?:HEADER)', line)
+    :return: list of pieces of text
+    """
+    text, starts, blank = index.text, index.starts, index.blank
+    # a header line only counts if a newline follows it
+    last = len(index) - 1
+    pieces = []
+    piece_start = 0
+    blank_run_start = None
+    i = 0
+    while i < len(index):
+        if blank[i]:
+            if blank_run_start is None:
+                blank_run_start = i
+            i += 1
+        elif headers[i] and i < last:
+            match_start = starts[i if blank_run_start is None
+                                 else blank_run_start]
+            # take in any following header lines, and blank lines between
+            match_end = i + 1
+            while True:
+                k = match_end
+                while k < len(index) and blank[k]:
+                    k += 1
+                if k < last and headers[k]:
+                    match_end = k + 1
+                else:
+                    break
+            pieces.append(text[piece_start:match_start])
+            piece_start = starts[match_end]
+            blank_run_start = None
+            i = match_end
+        else:
+            blank_run_start = None
+            i += 1
+    pieces.append(text[piece_start:])
+    return pieces
+
+
+def split_at_first_line(index, start_re):
+    """Split a text in two at the first line starting with a pattern
+
+    Gives the same pieces as re.split('(?:^\\s*' + START + ')', text,
+    flags=re.MULTILINE, maxsplit=1).
+    :param index: LineIndex of the text
+    :param start_re: compiled START pattern, which may run on over several
+        lines
+    :return: list of one or two pieces of text
+    """
+    text, starts, blank = index.text, index.starts, index.blank
+    blank_run_start = None
+    for i, line in enumerate(index.lines):
+        if blank[i]:
+            if blank_run_start is None:
+                blank_run_start = i
+            continue
+        start_match = start_re.match(
+            text, starts[i] + len(line) - len(line.lstrip()))
+        if start_match:
+            return [text[:starts[i if blank_run_start is None
+                                 else blank_run_start]],
+                    text[start_match.end():]]
+        blank_run_start = None
+    return [text]
+
+
+def find_witness_line(index, max_start):
+    """Find a panel's 'Witnesses: ...' or '... gave evidence' line
+
+    Gives the same match as re.search(
+    r'(witness(?:es)?:.*\\n|.*gave evidence\\.{,4})([\\s\\S]*)', text,
+    flags=re.IGNORECASE + re.MULTILINE), if it starts before max_start,
+    but only reads the lines up to max_start.
+    :param index: LineIndex of the panel text
+    :return: (start offset, witness line, rest of the text), or None
+    """
+    text, starts, lines = index.text, index.starts, index.lines
+    last = len(index) - 1
+    for i, line in enumerate(lines):
+        if starts[i] >= max_start:
+            break
+        if GAVE_EVIDENCE_RE.search(line) and \
+                not (i < last and WITNESSES_LABEL_RE.match(line)):
+            # '.*gave evidence' matches from the start of the line, up to
+            # the last 'gave evidence' in it, and up to four dots after
+            gave_evidence = None
+            for gave_evidence in GAVE_EVIDENCE_RE.finditer(line):
+                pass
+            end = gave_evidence.end()
+            while end < len(line) and end - gave_evidence.end() < 4 and \
+                    line[end] == '.':
+                end += 1
+            return starts[i], line[:end], text[starts[i] + end:]
+        label = WITNESSES_LABEL_RE.search(line) if i < last else None
+        if label:
+            if starts[i] + label.start() >= max_start:
+                break
+            return (starts[i] + label.start(), line[label.start():] + '\n',
+                    text[starts[i] + len(line) + 1:])
+    return None
+
+
+def find_first_qna_line(index):
+    """Find where a panel's Q&A starts, after its (unlabelled) witnesses
+    line
+
+    Gives the same match as re.search(
+    r'(.*\\n)((?:\\**Chair|\\**Q\\s?\\d+)[\\s\\S]*)', text,
+    flags=re.IGNORECASE + re.MULTILINE).
+    :param index: LineIndex of the panel text
+    :return: (line before the Q&A, Q&A text), or None
+    """
+    text, starts = index.text, index.starts
+    for i in range(len(index) - 1):
+        newline = starts[i] + len(index.lines[i])
+        if QNA_START_RE.match(text, newline + 1):
+            return text[starts[i]:newline + 1], text[newline + 1:]
+    return None
+
+
+def speaker_chunks(qna_text):
+    """Split Q&A text into each speaker's turn, in a single pass
+
+    Gives the same pieces as marking each new speaker with
+    re.sub(r'\\n(Q\\s?\\d+|\\_?\\*\\*)', r'\\nNEWSPEAKER\\g<1>', text) then
+    splitting with re.split('NEWSPEAKER', text).
+    :param qna_text: Q&A text, already stripped
+    :return: generator of pieces of text
+    """
+    chunk_start = 0
+    newline = qna_text.find('\n')
+    while newline != -1:
+        if NEW_SPEAKER_RE.match(qna_text, newline + 1):
+            # (any NEWSPEAKER already in the text splits it too)
+            for chunk in qna_text[chunk_start:newline + 1].split(
+                    'NEWSPEAKER'):
+                yield chunk
+            chunk_start = newline + 1
+        newline = qna_text.find('\n', newline + 1)
+    for chunk in qna_text[chunk_start:].split('NEWSPEAKER'):
+        yield chunk
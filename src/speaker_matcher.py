@@ -0,0 +1,70 @@
+from fuzzywuzzy import fuzz
+from fuzzywuzzy import utils as fuzz_utils
+
+
+class SpeakerMatcher(object):
+    """Fuzzy-match speaker labels against the names of a transcript's people
+
+    Gives the same best match and score as fuzzywuzzy's
+    process.extractOne(label, names), but the names are normalized and
+    indexed once per transcript instead of on every call. Each label is
+    first scored only against the names sharing a word or an initial with
+    it; we fall back to scoring every name only when none of those is a
+    confident match. Install python-Levenshtein for fuzzywuzzy's fast
+    C edit distance.
+    """
+    def __init__(self, names, confident_score=95):
+        """
+        :param names: candidate names (in order of preference for ties)
+        :param confident_score: score above which we trust the indexed
+            candidates without scanning all names
+        """
+        self.names = list(names)
+        self.confident_score = confident_score
+        self.processed_names = [normalize(n) for n in self.names]
+        self.index = {}
+        for i, processed in enumerate(self.processed_names):
+            for key in block_keys(processed):
+                self.index.setdefault(key, []).append(i)
+
+    def extract_one(self, label, score_cutoff=0):
+        """Best matching name for a speaker label
+
+        :return: (name, score), or None if no score reaches score_cutoff
+        """
+        processed_label = normalize(label)
+        candidates = sorted(set(i for key in block_keys(processed_label)
+                                for i in self.index.get(key, [])))
+        best = self._best_match(processed_label, candidates)
+        if best is None or best[1] < self.confident_score:
+            best = self._best_match(processed_label,
+                                    range(len(self.names)))
+        if best is None or best[1] < score_cutoff:
+            return None
+        return best
+
+    def _best_match(self, processed_label, candidates):
+        best = None
+        for i in candidates:
+            score = fuzz.WRatio(processed_label, self.processed_names[i],
+                                full_process=False)
+            # the first of equal scores wins, as with extractOne
+            if best is None or score > best[1]:
+                best = (self.names[i], score)
+        return best
+
+
+def normalize(name):
+    """Normalize a name exactly as process.extractOne does before scoring
+    with WRatio"""
+    return fuzz_utils.full_process(fuzz_utils.full_process(name),
+                                   force_ascii=True)
+
+
+def block_keys(processed_name):
+    """Index keys for a normalized name: each word, and each initial"""
+    keys = set()
+    for word in processed_name.split():
+        keys.add('w:' + word)
+        keys.add('i:' + word[0])
+    return keys
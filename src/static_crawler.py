@@ -0,0 +1,222 @@
+from .capture_text import Downloader
+from .retry import RetriesExhausted
+
+import lxml.html
+import requests
+
+
+class StaticPage(object):
+    """A server-rendered page, fetched over plain HTTP and parsed with lxml
+
+    Offers the few lookups the crawler needs from a browser: XPath queries,
+    links by text, drop-down options, and re-submitting a drop-down's form.
+    """
+    def __init__(self, response):
+        self.url = response.url
+        self.tree = lxml.html.fromstring(response.content,
+                                         base_url=response.url)
+        self.tree.make_links_absolute(response.url)
+
+    def hrefs_by_xpath(self, xpath):
+        return [e.get('href') for e in self.tree.xpath(xpath)]
+
+    def hrefs_by_class(self, class_name):
+        return self.hrefs_by_xpath(
+            '//*[contains(concat(" ", normalize-space(@class), " "), " %s ")]'
+            % class_name)
+
+    def link_hrefs(self, link_text, partial=False):
+        """hrefs of links whose text matches link_text, in page order"""
+        hrefs = []
+        for a in self.tree.xpath('//a[@href]'):
+            text = a.text_content().strip()
+            if text == link_text or (partial and link_text in text):
+                hrefs.append(a.get('href'))
+        return hrefs
+
+    def select(self, class_name):
+        selects = self.tree.xpath(
+            '//select[contains(concat(" ", normalize-space(@class), " "), '
+            '" %s ")]' % class_name)
+        return selects[0] if selects else None
+
+    def select_options(self, class_name):
+        """Visible text of each option in a drop-down, or None if absent"""
+        select = self.select(class_name)
+        if select is None:
+            return None
+        return [o.text_content().strip() for o in select.xpath('.//option')]
+
+    def form_request(self, class_name, option_text):
+        """Build the request made by choosing an option in a drop-down and
+        submitting its form
+
+        :return: (method, url, form data), or None if the drop-down is not
+            inside a form, which means the page relies on JavaScript
+        """
+        select = self.select(class_name)
+        forms = list(select.iterancestors('form')) if select is not None \
+            else []
+        if not forms or not select.get('name'):
+            return None
+        form = forms[0]
+        form_data = dict(form.form_values())
+        for o in select.xpath('.//option'):
+            if o.text_content().strip() == option_text:
+                form_data[select.get('name')] = o.get('value',
+                                                      o.text_content())
+        action = form.action or self.url
+        method = (form.method or 'GET').upper()
+        return method, action, form_data
+
+
+class StaticDownloader(Downloader):
+    """Crawl committee listing pages over plain HTTP instead of a browser
+
+    Most listing pages are plain server-rendered HTML, so we fetch them
+    with the document fetcher's session and run the same XPaths with lxml.
+    Drop-down selections are replayed as direct form submissions. Selenium
+    is only started for pages which turn out to need JavaScript (or which
+    can't be fetched), by falling back to the Downloader's browser crawl.
+    """
+
+    def get_page(self, url, method='GET', form_data=None):
+        """Fetch and parse a page, or return None on failure"""
+        def get_static_page():
+            with self.fetcher.host_limiter(url):
+                if method == 'POST':
+                    r = self.fetcher.session.post(url, data=form_data,
+                                                  timeout=30)
+                else:
+                    r = self.fetcher.session.get(url, params=form_data,
+                                                 timeout=30)
+            r.raise_for_status()
+            return r
+
+        # a couple of quick retries only: if the page still fails, the
+        # browser fallback gets a turn with the full retry policy
+        try:
+            r = self.fetcher.scheduler.call(
+                url, get_static_page,
+                retry_on=(requests.exceptions.RequestException,),
+                max_retries=2, dead_letter=False)
+        except RetriesExhausted:
+            self.logger.warning('Static fetch failed: %s' % url)
+            return None
+        return StaticPage(r)
+
+    def submit_option(self, page, class_name, option_text):
+        """Choose an option in a page's drop-down and submit its form
+
+        :return: the resulting StaticPage, or None if this needs a browser
+        """
+        form_request = page.form_request(class_name, option_text)
+        if form_request is None:
+            return None
+        method, action, form_data = form_request
+        return self.get_page(action, method, form_data)
+
+    def committees_urls_list(self):
+        page = self.get_page(self.committees_page)
+        xp_committees_list = '//div[@class="a-to-z-listing"]/ul[@class="square-bullets-a-to-z"]/li/h3/a'
+        urls = page.hrefs_by_xpath(xp_committees_list) if page else []
+        if not urls:
+            return super().committees_urls_list()
+        return urls
+
+    def crawl_committee_pages(self, committee_url):
+        page = self.get_page(committee_url)
+        if page is None:
+            return super().crawl_committee_pages(committee_url)
+
+        pubs_links = page.link_hrefs('Publications')
+        if len(pubs_links) > 0 and committee_url in pubs_links[0]:
+            self.visit(pubs_links[0], self.crawl_publications_section)
+        else:
+            self.logger.warning(
+                "No Top-Level Publications Link for this committee: "
+                + committee_url)
+
+        inquiries_links = page.link_hrefs('Inquiries', partial=True)
+        if len(inquiries_links) > 0 and committee_url in inquiries_links[0]:
+            self.logger.info("Processing all inquiries: " + inquiries_links[0])
+            self.visit(inquiries_links[0], self.crawl_inquiries_section)
+        else:
+            self.logger.warning("No Inquiries for this committee: " + committee_url)
+
+    def crawl_publications_section(self, publications_url):
+        page = self.get_page(publications_url)
+        if page is None:
+            return super().crawl_publications_section(publications_url)
+        self.queue_oral_evidence_urls(self.document_hrefs(page), page.url)
+
+        all_options = page.select_options('ctlSession')
+        if not all_options:
+            self.logger.info('no publications drop-down processed')
+            return
+        xp_publication_items = '//ul[@id="publication-items"]/li/a'
+        urls = page.hrefs_by_xpath(xp_publication_items)
+        for publications_filter_option in all_options:
+            option_page = self.submit_option(page, 'ctlSession',
+                                             publications_filter_option)
+            if option_page is None:
+                return super().crawl_publications_section(publications_url)
+            page = option_page
+            urls = urls + page.hrefs_by_xpath(xp_publication_items)
+        self.queue_oral_evidence_urls(urls, page.url)
+
+    def crawl_inquiries_section(self, inquiries_url):
+        page = self.get_page(inquiries_url)
+        if page is None:
+            return super().crawl_inquiries_section(inquiries_url)
+        all_options = page.select_options('parliamentYearPicker')
+        if all_options is None:
+            return super().crawl_inquiries_section(inquiries_url)
+        urls = []
+        for inquiries_filter_option in all_options:
+            option_page = self.submit_option(page, 'parliamentYearPicker',
+                                             inquiries_filter_option)
+            if option_page is None:
+                # the year picker works by JavaScript on this page
+                return super().crawl_inquiries_section(inquiries_url)
+            page = option_page
+            # current inquiries list format:
+            xp_current_inquiries = '//ul[@id="inquiries"]/li/a'
+            urls = urls + page.hrefs_by_xpath(xp_current_inquiries)
+            # historical inquiries list format:
+            xp_historical_inquiries = '//div[@class="a-to-z-listing"]/ul[@class="square-bullets-a-to-z"]/li/h3/a'
+            urls = urls + page.hrefs_by_xpath(xp_historical_inquiries)
+
+        self.logger.info("Found %i inquiries" % len(urls))
+        for i, url in enumerate(urls):
+            self.visit(url, self.crawl_inquiry)
+
+    def crawl_inquiry(self, inquiry_url):
+        self.logger.info("Starting inquiry: %s" % inquiry_url)
+        page = self.get_page(inquiry_url)
+        if page is None:
+            return super().crawl_inquiry(inquiry_url)
+        pubs_links = page.link_hrefs('Publications')
+        if len(pubs_links) > 0:
+            page = self.get_page(pubs_links[0])
+            if page is None:
+                return super().crawl_inquiry(inquiry_url)
+            self.logger.info(
+                "Found a Publications page for the inquiry: %s" % inquiry_url)
+        else:
+            self.logger.info(
+                "Found no Publications page for the inquiry: %s " % inquiry_url)
+        # if there's a 'publications types' drop-down then select Oral
+        # Evidence, otherwise take the full list of URLs
+        publication_types = page.select_options('ctlType') or []
+        if 'Oral evidence' in publication_types:
+            oral_page = self.submit_option(page, 'ctlType', 'Oral evidence')
+            if oral_page is None:
+                return super().crawl_inquiry(inquiry_url)
+            page = oral_page
+        self.queue_oral_evidence_urls(self.document_hrefs(page), page.url)
+
+    @staticmethod
+    def document_hrefs(page):
+        return page.hrefs_by_class('document-title') + \
+               page.hrefs_by_class('document')
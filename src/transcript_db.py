@@ -0,0 +1,162 @@
+from .corpus_tables import TABLES
+
+import threading
+import sqlite3
+import os
+
+
+SQL_TYPES = {'string': 'TEXT', 'int64': 'INTEGER'}
+
+# (table, columns) to index, for the lookups of the query methods
+INDEXES = [('transcripts', ['document']),
+           ('transcripts', ['committee']),
+           ('people', ['document']),
+           ('people', ['speaker_type', 'name']),
+           ('people', ['canonical_id']),
+           ('speakers', ['document']),
+           ('speakers', ['speaker_type', 'speaker_name']),
+           ('sections', ['document', 'section_id']),
+           ('sections', ['speaker_type', 'speaker_name']),
+           ('sections', ['canonical_id']),
+           ('sections', ['question_number'])]
+
+
+class TranscriptDB(object):
+    """SQLite database of parsed transcripts
+
+    Holds the corpus tables of corpus_tables.TABLES (transcripts, people,
+    speakers, and the Q&A sections), indexed for lookups by committee,
+    witness, speaker type and question number, so that questions such as
+    'every answer given by this witness' don't need a scan of the whole
+    corpus. Safe to share between threads and worker processes.
+    """
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self._connection = None
+        self._connection_pid = None
+
+    @property
+    def connection(self):
+        # one connection per process: SQLite connections must not be
+        # carried across a fork
+        if self._connection_pid != os.getpid():
+            self._connection = sqlite3.connect(self.db_path, timeout=60,
+                                               check_same_thread=False)
+            self._connection.row_factory = sqlite3.Row
+            for table, columns in TABLES.items():
+                self._connection.execute(
+                    'CREATE TABLE IF NOT EXISTS %s (%s)' % (
+                        table, ', '.join('%s %s' % (name, SQL_TYPES[t])
+                                         for name, t in columns)))
+            for table, columns in INDEXES:
+                self._connection.execute(
+                    'CREATE INDEX IF NOT EXISTS %s_%s ON %s (%s)' % (
+                        table, '_'.join(columns), table, ', '.join(columns)))
+            self._connection_pid = os.getpid()
+        return self._connection
+
+    def add_transcripts(self, transcripts_rows):
+        """Store parsed transcripts, replacing any earlier versions
+
+        :param transcripts_rows: list of corpus_tables.transcript_rows
+            results
+        """
+        with self.lock:
+            with self.connection:
+                for rows in transcripts_rows:
+                    document = rows['transcripts'][0]['document']
+                    for table, columns in TABLES.items():
+                        self.connection.execute(
+                            'DELETE FROM %s WHERE document = ?' % table,
+                            (document,))
+                        self.connection.executemany(
+                            'INSERT INTO %s VALUES (%s)' % (
+                                table, ', '.join('?' * len(columns))),
+                            [[row.get(name) for name, t in columns]
+                             for row in rows.get(table, [])])
+
+    def documents(self, committee=None):
+        """Names of the stored transcripts, optionally of one committee"""
+        if committee:
+            rows = self.query('SELECT document FROM transcripts '
+                              'WHERE committee = ? ORDER BY document',
+                              (committee,))
+        else:
+            rows = self.query('SELECT document FROM transcripts '
+                              'ORDER BY document')
+        return [row['document'] for row in rows]
+
+    def sections(self, document=None, speaker_name=None, speaker_type=None,
+                 question_number=None, canonical_id=None, committee=None):
+        """Q&A sections matching all of the given conditions
+
+        e.g. sections(speaker_name='Jane Doe', speaker_type='witness') for
+        every answer by a witness
+        :return: list of sqlite3.Row, in document and section order
+        """
+        conditions = []
+        parameters = []
+        for column, value in [('document', document),
+                              ('speaker_name', speaker_name),
+                              ('speaker_type', speaker_type),
+                              ('question_number', question_number),
+                              ('canonical_id', canonical_id)]:
+            if value is not None:
+                conditions.append('sections.%s = ?' % column)
+                parameters.append(value)
+        if committee is not None:
+            conditions.append('sections.document IN (SELECT document FROM '
+                              'transcripts WHERE committee = ?)')
+            parameters.append(committee)
+        return self.query(
+            'SELECT * FROM sections%s ORDER BY document, section_id' % (
+                ' WHERE ' + ' AND '.join(conditions) if conditions else ''),
+            parameters)
+
+    def people(self, name=None, speaker_type=None, canonical_id=None):
+        """People named in transcripts' headers, matching the conditions"""
+        conditions = []
+        parameters = []
+        for column, value in [('speaker_type', speaker_type), ('name', name),
+                              ('canonical_id', canonical_id)]:
+            if value is not None:
+                conditions.append('%s = ?' % column)
+                parameters.append(value)
+        return self.query(
+            'SELECT * FROM people%s ORDER BY document, person_id' % (
+                ' WHERE ' + ' AND '.join(conditions) if conditions else ''),
+            parameters)
+
+    def query(self, sql, parameters=()):
+        """Run any SQL query on the database
+
+        :return: list of sqlite3.Row
+        """
+        with self.lock:
+            return self.connection.execute(sql, parameters).fetchall()
+
+    def read_tables(self, tables=None, speaker_type=None):
+        """Tables as DataFrames, as from corpus_tables.load_corpus_tables
+
+        :param tables: names of the tables to read (default: all)
+        :param speaker_type: only read the rows of people, speakers and
+            sections of this type, e.g. 'witness'
+        :return: dict of table name to DataFrame
+        """
+        import pandas as pd
+        frames = {}
+        for table in tables or list(TABLES):
+            columns = [name for name, t in TABLES[table]]
+            # in the order the transcripts were added
+            if speaker_type and 'speaker_type' in columns:
+                sql = 'SELECT * FROM %s WHERE speaker_type = ? ' \
+                      'ORDER BY rowid' % table
+                parameters = (speaker_type,)
+            else:
+                sql = 'SELECT * FROM %s ORDER BY rowid' % table
+                parameters = ()
+            with self.lock:
+                frames[table] = pd.read_sql_query(sql, self.connection,
+                                                  params=parameters)
+        return frames
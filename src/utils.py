@@ -3,7 +3,6 @@ import logging
 import time
 import datetime
 import argparse
-import html2text
 import re
 from os import path
 import sys
@@ -16,47 +15,119 @@ parser.add_argument('--download', action='store_true') # store_true -> default a
 parser.add_argument('--parse', action='store_true')
 parser.add_argument('--diagnostic', action='store_true')
 parser.add_argument('--analyse', action='store_true')
-args = parser.parse_args()
+parser.add_argument('--download_workers', type=int, default=8)  # threads downloading documents
+parser.add_argument('--download_mode', choices=['thread', 'async'], default='thread')  # 'async' downloads on an asyncio event loop
+parser.add_argument('--async_in_flight', type=int, default=1000)  # max downloads in flight in async mode
+parser.add_argument('--host_concurrency', type=int, default=4)  # simultaneous requests per host
+parser.add_argument('--host_rate', type=float, default=2.0)  # max requests per second per host
+parser.add_argument('--parse_workers', type=int, default=2)  # threads converting downloaded documents
+parser.add_argument('--parse_queue', type=int, default=50)  # max downloaded documents waiting to be parsed
+parser.add_argument('--crawler', choices=['static', 'browser'], default='static')  # 'static' only starts a browser for pages needing JavaScript
+parser.add_argument('--browsers', type=int, default=1)  # parallel browser workers crawling committees
+parser.add_argument('--headless', action='store_true')  # run the crawl browsers without a display
+parser.add_argument('--listing_ttl', type=float, default=24)  # hours before a crawled listing page is loaded again
+parser.add_argument('--max_retries', type=int, default=10)  # retries before a URL is dead-lettered
+parser.add_argument('--retry_base_delay', type=float, default=5)  # secs before the first retry, doubling each time
+parser.add_argument('--breaker_threshold', type=int, default=5)  # consecutive failures which pause requests to a host
+parser.add_argument('--breaker_cooldown', type=float, default=60)  # secs to pause a failing host
+parser.add_argument('--include_pdf', action='store_true')  # download PDF evidence even when there's a HTML version
+parser.add_argument('--parse_processes', type=int, default=None)  # worker processes for --parse (default: one per core)
+parser.add_argument('--force', action='store_true')  # --parse and --diagnostic redo every document, not just those changed since the last run
+parser.add_argument('--parse_timeout', type=float, default=60)  # seconds allowed to parse each document before it is quarantined (0: no limit)
+parser.add_argument('--retry_quarantined', action='store_true')  # --parse documents quarantined by earlier runs, rather than skipping them
+parser.add_argument('--outputs', nargs='+', choices=['txt', 'json', 'summary', 'stats', 'tables'], default=['txt', 'json', 'summary'])  # what --parse saves: text and JSON per document, summary.xlsx, speaker_summary.xlsx, corpus tables
+parser.add_argument('--tables_format', choices=['parquet', 'jsonl', 'sqlite'], default='parquet')  # corpus tables as Parquet files, one JSON Lines file, or an SQLite database
+parser.add_argument('--from_tables', action='store_true')  # --diagnostic and --analyse read the corpus tables rather than the JSON files
+parser.add_argument('--ner_cache', choices=['disk', 'memory'], default='disk')  # keep spaCy results for name fragments between runs
+parser.add_argument('--person_registry', choices=['disk', 'memory'], default='disk')  # keep the register of people's names between runs
+parser.add_argument('--html_engine', choices=['html2text', 'lxml'], default='html2text')  # 'lxml' converts HTML to text faster (experimental: not yet checked on the real corpus, see --compare_html)
+parser.add_argument('--compare_html', type=int, default=0)  # compare the html engines on a sample of this many stored documents
+parser.add_argument('--refresh', action='store_true')  # re-check downloaded documents with conditional GETs
+parser.add_argument('--recrawl', action='store_true')  # ignore checkpoints of committees already crawled
+# defaults, until configure() reads the command line
+args = parser.parse_args([])
 
 
 batch_number = 999
 
-"""Set up logging
-"""
-# log_file_name = 'sec_extractor_{0}.log'.format(ts)
-log_file_name = 'parliament-text_%s.log' % format(batch_number, '04d')
-log_path = path.join(args.storage, log_file_name)
-
 logger = logging.getLogger('text_analysis')
 # # set up the logger if it hasn't already been set up earlier in the execution run
 logger.setLevel(logging.DEBUG)  # we have to initialise this top-level setting otherwise everything defaults to logging.WARN level
-formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s',
-                              '%Y%m%d %H:%M:%S')
 
-file_handler = logging.FileHandler(log_path)
-file_handler.setFormatter(formatter)
-file_handler.setLevel(logging.DEBUG)
-file_handler.set_name('my_file_handler')
-logger.addHandler(file_handler)
 
-console_handler = logging.StreamHandler()
-console_handler.setFormatter(formatter)
-console_handler.setLevel(logging.DEBUG)
-console_handler.set_name('my_console_handler')
-logger.addHandler(console_handler)
+def configure(argv=None):
+    """Read the command line options into args, and start logging
+
+    Nothing is parsed or opened when this module is imported, so that
+    modules can be imported cheaply (e.g. by worker processes) and
+    configured separately.
+    :param argv: list of command line arguments (default: sys.argv[1:])
+    :return: args
+    """
+    parser.parse_args(argv, namespace=args)
+    configure_logging()
+    ts = time.time()
+    logger.info('=' * 65)
+    logger.info('Analysis started at {0}'.
+                format(datetime.datetime.fromtimestamp(ts).
+                       strftime('%Y%m%d %H:%M:%S')))
+    logger.info('Command line:\t{0}'.format(sys.argv[0]))
+    logger.info('Arguments:\t\t{0}'.format(' '.join(sys.argv[:])))
+    logger.info('=' * 65)
+    return args
+
+
+def configure_worker(worker_args):
+    """Configure a worker process with its parent's options
+
+    :param worker_args: dict of the parent's args, i.e. vars(args)
+    """
+    vars(args).update(worker_args)
+    configure_logging()
+
 
+def configure_logging():
+    """Add the console handler, and a log file handler in the storage
+    folder (does nothing if the handlers are already set up)"""
+    formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s',
+                                  '%Y%m%d %H:%M:%S')
+    handler_names = [h.get_name() for h in logger.handlers]
 
-ts = time.time()
-logger.info('=' * 65)
-logger.info('Analysis started at {0}'.
-            format(datetime.datetime.fromtimestamp(ts).
-                   strftime('%Y%m%d %H:%M:%S')))
-logger.info('Command line:\t{0}'.format(sys.argv[0]))
-logger.info('Arguments:\t\t{0}'.format(' '.join(sys.argv[:])))
-logger.info('=' * 65)
+    if args.storage and 'my_file_handler' not in handler_names:
+        # log_file_name = 'sec_extractor_{0}.log'.format(ts)
+        log_file_name = 'parliament-text_%s.log' % format(batch_number, '04d')
+        log_path = path.join(args.storage, log_file_name)
+        file_handler = logging.FileHandler(log_path)
+        file_handler.setFormatter(formatter)
+        file_handler.setLevel(logging.DEBUG)
+        file_handler.set_name('my_file_handler')
+        logger.addHandler(file_handler)
+
+    if 'my_console_handler' not in handler_names:
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(formatter)
+        console_handler.setLevel(logging.DEBUG)
+        console_handler.set_name('my_console_handler')
+        logger.addHandler(console_handler)
+
+
+class ContextLogger(logging.LoggerAdapter):
+    """Logger which prefixes each message with a context label, e.g. to
+    tell apart messages from parallel workers"""
+    def process(self, msg, kwargs):
+        return '[%s] %s' % (self.extra['context'], msg), kwargs
 
 
 def html_to_txt(raw_html):
+    """Convert HTML to plain text, with the engine chosen by --html_engine"""
+    if args.html_engine == 'lxml':
+        from .html_convert import html_to_markdown
+        return html_to_markdown(raw_html)
+    return html2text_to_txt(raw_html)
+
+
+def html2text_to_txt(raw_html):
+    import html2text
     h = html2text.HTML2Text()  # consider using API field 'bodyText' instead?
     h.body_width = 0
     h.google_doc = True
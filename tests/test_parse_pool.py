@@ -0,0 +1,60 @@
+import time
+
+import pytest
+
+from src.utils import configure, args
+from src.document_store import document_store
+from src import parse_pool
+from src import parse_text
+
+
+HTML = '<html><body><p>Oral evidence</p></body></html>'
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    configure(['--storage', str(tmp_path), '--parse_timeout', '0.5',
+               '--outputs', 'stats'])
+    monkeypatch.setattr(parse_pool, '_quarantine', None)
+    document_store().put('1.html', HTML)
+    document_store().put('2.html', HTML)
+    return tmp_path
+
+
+def never_finish(self, *arguments, **kwargs):
+    while True:
+        time.sleep(0.01)
+
+
+def test_overrunning_document_is_quarantined(storage, monkeypatch):
+    monkeypatch.setattr(parse_text.transcript, 'process_raw_html',
+                        never_finish)
+    start = time.time()
+    assert parse_pool.parse_document('1.html') is None
+    assert time.time() - start < 2
+
+    entries = parse_pool.get_quarantine().entries()
+    assert list(entries) == ['1.html']
+    assert entries['1.html']['budget_secs'] == 0.5
+    assert entries['1.html']['elapsed_secs'] >= 0.5
+    assert entries['1.html']['html_chars'] == len(HTML)
+    assert 'time budget' in entries['1.html']['reason']
+
+
+def test_quarantined_document_skipped_unless_retried(storage, monkeypatch):
+    monkeypatch.setattr(parse_text.transcript, 'process_raw_html',
+                        never_finish)
+    parse_pool.parse_document('1.html')
+    assert parse_pool.skip_quarantined(['1.html', '2.html']) == ['2.html']
+
+    monkeypatch.setattr(args, 'retry_quarantined', True)
+    assert parse_pool.skip_quarantined(['1.html', '2.html']) == \
+        ['1.html', '2.html']
+    # and a retry which succeeds takes it out of quarantine
+    monkeypatch.setattr(parse_text.transcript, 'process_raw_html',
+                        lambda self, *arguments, **kwargs: None)
+    monkeypatch.setattr(parse_text.transcript, 'key_data_summary',
+                        lambda self: ({}, '1.html'))
+    monkeypatch.setattr(args, 'outputs', [])
+    assert parse_pool.parse_document('1.html') is not None
+    assert parse_pool.get_quarantine().names() == set()
@@ -0,0 +1,100 @@
+import threading
+import time
+
+import pytest
+
+from src import parse_watchdog
+from src.parse_watchdog import ParseTimeout, time_budget, regex_search
+
+
+# overlapping alternatives, which backtrack for ever on a string that
+# nearly matches (and which regex can't optimise away, as it does e.g.
+# '(a+)+b')
+CATASTROPHIC_PATTERN = r'(a|aa)+$'
+CATASTROPHIC_STRING = 'a' * 40 + 'b'
+
+
+def search_in_budget(budget):
+    """Run the catastrophic pattern within a time budget
+
+    :return: the exception raised, and the seconds taken
+    """
+    start = time.time()
+    try:
+        with time_budget(budget):
+            regex_search(CATASTROPHIC_PATTERN, CATASTROPHIC_STRING)
+    except Exception as e:
+        return e, time.time() - start
+    return None, time.time() - start
+
+
+@pytest.mark.skipif(not parse_watchdog.REGEX_TIMEOUT,
+                    reason='needs a regex module with match timeouts')
+def test_catastrophic_pattern_times_out_in_main_thread():
+    exception, elapsed = search_in_budget(0.5)
+    assert isinstance(exception, ParseTimeout)
+    assert elapsed < 2
+
+
+@pytest.mark.skipif(not parse_watchdog.REGEX_TIMEOUT,
+                    reason='needs a regex module with match timeouts')
+def test_catastrophic_pattern_times_out_in_other_thread():
+    # no alarm outside the main thread: only the regex timeout stops it
+    results = []
+    thread = threading.Thread(
+        target=lambda: results.append(search_in_budget(0.5)))
+    thread.start()
+    thread.join(10)
+    assert not thread.is_alive()
+    exception, elapsed = results[0]
+    assert isinstance(exception, ParseTimeout)
+    assert elapsed < 2
+
+
+def test_regex_timeout_detected():
+    # regex releases that take timeout as a named list don't count
+    if parse_watchdog.regex is None:
+        assert not parse_watchdog.REGEX_TIMEOUT
+    else:
+        import inspect
+        assert parse_watchdog.REGEX_TIMEOUT == (
+            'timeout' in inspect.signature(
+                parse_watchdog.regex.search).parameters)
+
+
+def test_no_budget_no_limit():
+    with time_budget(0):
+        assert regex_search(r'a+b', 'aaab')
+    assert parse_watchdog.remaining_time() is None
+
+
+def test_quarantine_records_diagnostics(tmp_path):
+    quarantine = parse_watchdog.Quarantine(
+        str(tmp_path / 'parse_quarantine.sqlite'))
+    quarantine.add('1.html', {'reason': 'ran over the time budget',
+                              'stage': 'parse_header'})
+    quarantine.add('2.html', {'reason': 'ran over the time budget',
+                              'stage': None})
+    assert quarantine.names() == {'1.html', '2.html'}
+    entry = quarantine.entries()['1.html']
+    assert entry['stage'] == 'parse_header'
+    assert entry['quarantined_at']
+
+    quarantine.remove('1.html')
+    # and it's kept on disk, for later runs
+    assert parse_watchdog.Quarantine(
+        str(tmp_path / 'parse_quarantine.sqlite')).names() == {'2.html'}
+
+
+def test_timeout_diagnostics():
+    def overrun():
+        raise ParseTimeout('ran over the time budget')
+    try:
+        overrun()
+    except ParseTimeout as e:
+        diagnostics = parse_watchdog.timeout_diagnostics(e, 60, 61.234,
+                                                         html_chars=10)
+    # (no stage, outside the parser's modules)
+    assert diagnostics == {'reason': 'ran over the time budget',
+                           'stage': None, 'budget_secs': 60,
+                           'elapsed_secs': 61.23, 'html_chars': 10}